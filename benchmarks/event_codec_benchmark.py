@@ -0,0 +1,56 @@
+# Microbenchmark of the Kafka event round trip (encode on the producer, decode on the consumer).
+# Compares the old str(dict) + quote replace + json.loads round trip with event_codec.
+# Run this command from the repository root: python benchmarks/event_codec_benchmark.py
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'order-service', 'api'))
+import event_codec
+from event_codec import PaymentSucceeded, decode, encode
+from schema_registry import FileSchemaRegistry
+
+ROUNDS = 200000
+
+payment = {
+    "payment_id": "4f1c6f3e-1d7e-4a55-9f3f-2b1f2b8e9a10",
+    "order_id": "bd5f8583-83a4-40c4-8ec7-18a685eef130",
+    "amount": 149.99,
+    "payment_gateway_response": "Transaction approved",
+}
+payment_event = PaymentSucceeded(**payment)
+
+
+# Producer side str(dict), consumer side decode + quote replace + json.loads, as the services used to do
+def legacy_round_trip():
+    value = str(payment).encode('utf-8')
+    data = value.decode('utf-8')
+    data = data.replace("'", "\"")
+    return json.loads(data)
+
+
+def codec_round_trip():
+    return decode(PaymentSucceeded, encode(payment_event))
+
+
+def report(name, seconds):
+    print(f"{name:<22} {seconds / ROUNDS * 1e9:8.0f} ns/event  {ROUNDS / seconds:12,.0f} events/sec")
+
+
+if __name__ == "__main__":
+    assert codec_round_trip() == payment_event
+    legacy = min(timeit.repeat(legacy_round_trip, number=ROUNDS, repeat=3))
+    codec = min(timeit.repeat(codec_round_trip, number=ROUNDS, repeat=3))
+    report("str(dict) + json.loads", legacy)
+    report("event_codec", codec)
+    print(f"speedup: {legacy / codec:.1f}x, payload: {len(str(payment))} -> {len(encode(payment_event))} bytes")
+
+    # Same round trip with the schema registry wire format, using the file backed stand-in registry
+    with tempfile.TemporaryDirectory() as directory:
+        event_codec.configure('avro', FileSchemaRegistry(os.path.join(directory, 'registry.json')))
+        assert codec_round_trip() == payment_event
+        avro = min(timeit.repeat(codec_round_trip, number=ROUNDS, repeat=3))
+        report("event_codec (avro)", avro)
+        print(f"avro payload: {len(encode(payment_event))} bytes")
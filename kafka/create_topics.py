@@ -0,0 +1,50 @@
+# This library we are using to get environmental variables from .env file. Install this dependency by running this command : pip install python-decouple
+from decouple import config, Csv
+# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
+from confluent_kafka.admin import AdminClient, NewPartitions, NewTopic
+
+# Kafka Configuration
+KAFKA_BOOTSTRAP_SERVERS = config('KAFKA_BOOTSTRAP_SERVERS')
+KAFKA_TOPICS = config('KAFKA_TOPICS', cast=Csv())
+KAFKA_TOPIC_PARTITIONS = config('KAFKA_TOPIC_PARTITIONS', default=6, cast=int)
+KAFKA_TOPIC_REPLICATION_FACTOR = config('KAFKA_TOPIC_REPLICATION_FACTOR', default=1, cast=int)
+
+
+# Create the missing topics with KAFKA_TOPIC_PARTITIONS partitions and grow the existing ones up to it.
+# Every event is keyed (user id, product id or order id), so the partition count is the number of consumers
+# which can share a topic while the events of one entity stay in order on one partition.
+# Growing a topic moves keys to other partitions, so only do it while its consumers are drained.
+def create_topics(admin):
+    existing = admin.list_topics(timeout=10).topics
+
+    new_topics = [
+        NewTopic(topic, num_partitions=KAFKA_TOPIC_PARTITIONS, replication_factor=KAFKA_TOPIC_REPLICATION_FACTOR)
+        for topic in KAFKA_TOPICS if topic not in existing
+    ]
+    grown_topics = [
+        NewPartitions(topic, KAFKA_TOPIC_PARTITIONS)
+        for topic in KAFKA_TOPICS if topic in existing and len(existing[topic].partitions) < KAFKA_TOPIC_PARTITIONS
+    ]
+
+    futures = {}
+    if new_topics:
+        futures.update(admin.create_topics(new_topics))
+    if grown_topics:
+        futures.update(admin.create_partitions(grown_topics))
+
+    for topic, future in futures.items():
+        try:
+            future.result()
+            print(f"Topic {topic} has {KAFKA_TOPIC_PARTITIONS} partitions")
+        except Exception as e:
+            print(f"Failed to provision topic {topic}: {e}")
+
+    for topic in KAFKA_TOPICS:
+        if topic in existing and topic not in futures:
+            print(f"Topic {topic} already has {len(existing[topic].partitions)} partitions")
+
+
+if __name__ == "__main__":
+    create_topics(AdminClient({'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS}))
+
+# Run this command from the kafka directory to create the topics: python create_topics.py
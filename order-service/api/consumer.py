@@ -1,10 +1,32 @@
-from sanic import Sanic
 # This we are using to get environmental variables from .env file. Install this dependency by running this command : pip install python-decouple
 from decouple import config 
-from confluent_kafka import Consumer, KafkaError, Producer
+from confluent_kafka import KafkaError
+# Asyncio adapters around the confluent_kafka Consumer and Producer
+from kafka_consumer import AsyncConsumer, batch_offsets
+from kafka_producer import AsyncProducer
+# Coalesced manual offset commits
+from offset_committer import OffsetCommitter
+# Order queries on the consumer's pool and the guarded order status transitions
+from order_repository import OrderRepository
+from order_state import FAILED, PAID, apply_transition, normalize_order_id
+# Concurrent processing of the partitions, in order per key
+from partition_workers import PartitionWorkers
+# Recently processed events, to skip redelivered ones
+from idempotency import ProcessedEventCache
+# Delayed retries of the messages whose processing failed
+from retry_pipeline import RetryConsumer, RetryRouter, parse_retry_tiers
+# Bulk rebuild of registered_users from the user-registration topic
+from user_replay import replay_user_registrations
+import argparse
 import asyncpg
-import json
 import asyncio
+import signal
+import uuid
+from collections import Counter
+# Typed decoding of the Kafka events. Install this dependency by running this command : pip install msgspec
+from event_codec import DeadLetter, DecodeError, PaymentFailed, PaymentSucceeded, UserRegistered, configure as configure_codec, decode, encode
+# Client for the Confluent schema registry used by the avro wire format
+from schema_registry import open_registry
 
 # Database Configuration from .env file
 DB_HOST = config('DB_HOST')
@@ -21,6 +43,39 @@ KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG = config('KAKFA_CONSUMER_SUBSCRIBE_TOPIC_
 KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC = config('KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC')
 KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL = config('KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL')
 KAFKA_PRODUCER_RETRIES = config('KAFKA_PRODUCER_RETRIES', default=3, cast=int)
+# Event Configuration, avro payloads are decoded whatever the format as long as a registry is configured
+EVENT_WIRE_FORMAT = config('EVENT_WIRE_FORMAT', default='json')
+SCHEMA_REGISTRY_URL = config('SCHEMA_REGISTRY_URL', default='')
+# Batch Configuration, with CONSUMER_BATCH_SIZE above 1 up to that many messages are applied in one transaction
+CONSUMER_BATCH_SIZE = config('CONSUMER_BATCH_SIZE', default=1, cast=int)
+CONSUMER_BATCH_TIMEOUT = config('CONSUMER_BATCH_TIMEOUT', default=1.0, cast=float)  # seconds to wait for a full batch
+CONSUMER_QUEUE_SIZE = config('CONSUMER_QUEUE_SIZE', default=10, cast=int)  # fetched batches buffered ahead of the processing
+# Fetch Configuration outside batch mode, messages handed from the fetch thread to the loop at a time and seconds consume()
+# waits to fill such a chunk. In batch mode a fetched chunk is a batch (CONSUMER_BATCH_SIZE, CONSUMER_BATCH_TIMEOUT).
+CONSUMER_FETCH_SIZE = config('CONSUMER_FETCH_SIZE', default=100, cast=int)
+CONSUMER_FETCH_TIMEOUT = config('CONSUMER_FETCH_TIMEOUT', default=0.1, cast=float)
+# Worker Configuration, outside batch mode up to CONSUMER_CONCURRENCY messages of different partitions (or of different
+# key lanes of a partition) are processed at once. It is also the size of the DB pool.
+CONSUMER_CONCURRENCY = config('CONSUMER_CONCURRENCY', default=10, cast=int)
+CONSUMER_LANES_PER_PARTITION = config('CONSUMER_LANES_PER_PARTITION', default=1, cast=int)
+# Commit Configuration, processed offsets are committed every CONSUMER_COMMIT_EVERY messages or CONSUMER_COMMIT_INTERVAL seconds
+CONSUMER_COMMIT_EVERY = config('CONSUMER_COMMIT_EVERY', default=1000, cast=int)
+CONSUMER_COMMIT_INTERVAL = config('CONSUMER_COMMIT_INTERVAL', default=1.0, cast=float)
+# Idempotency Configuration, number of recently processed event ids remembered to skip duplicates
+CONSUMER_DEDUP_CACHE_SIZE = config('CONSUMER_DEDUP_CACHE_SIZE', default=100000, cast=int)
+# Group Membership Configuration. With a static CONSUMER_INSTANCE_ID (group.instance.id) a restart within the
+# session timeout gets its partitions back without a rebalance. consumer_launcher.py sets one per process.
+CONSUMER_INSTANCE_ID = config('CONSUMER_INSTANCE_ID', default='')
+CONSUMER_SESSION_TIMEOUT_MS = config('CONSUMER_SESSION_TIMEOUT_MS', default=45000, cast=int)
+# Retry Configuration, a message whose processing fails goes through these 'topic:delay seconds' tiers before the DLQ.
+# The retry topics are consumed by their own group. Leave it empty to send the failures straight to the DLQ.
+CONSUMER_RETRY_TOPICS = config('CONSUMER_RETRY_TOPICS', default='retry-5s:5,retry-1m:60,retry-10m:600')
+CONSUMER_RETRY_GROUP_ID = config('CONSUMER_RETRY_GROUP_ID', default=KAFKA_CONSUMER_GROUP_ID + '-retry')
+# Replay Configuration (--replay), messages fetched per chunk, rows staged before they are merged into
+# registered_users and seconds between progress reports
+REPLAY_CHUNK_SIZE = config('REPLAY_CHUNK_SIZE', default=10000, cast=int)
+REPLAY_MERGE_EVERY = config('REPLAY_MERGE_EVERY', default=500000, cast=int)
+REPLAY_PROGRESS_INTERVAL = config('REPLAY_PROGRESS_INTERVAL', default=5.0, cast=float)
 
 # Database connection
 db_config = {
@@ -31,33 +86,245 @@ db_config = {
     'port': DB_PORT,
 }
 
-# Database setup (similar to the Sanic app setup)
+# Database setup (similar to the Sanic app setup), one connection per concurrent worker
 async def setup_db():
-    return await asyncpg.create_pool(**db_config)
+    return await asyncpg.create_pool(**db_config, min_size=1, max_size=CONSUMER_CONCURRENCY)
 
-# Define a function to close the database connection pool
-async def close_db(app):
-    await app.ctx.db.close()
-
-async def check_order_status(order_id):
-    pool = await setup_db()
-    try:
-        async with pool.acquire() as connection:              
-            query = "SELECT status FROM order_service_db.orders WHERE id = $1"
-            rows = await connection.fetchval(query, order_id)
-        return rows
-    except Exception as e:         
+# Check if the message has an error
+def consumer_error(msg):
+    if not msg.error():
         return False
-# Order Service consumer
-async def order_service_consumer():
+    if msg.error().code() == KafkaError._PARTITION_EOF:
+        print("Reached end of partition")
+    else:
+        print("Consumer error: {}".format(msg.error()))
+    return True
+
+# Report the asynchronous offset commits which failed, called from the consumer's fetch thread
+def commit_callback(err, partitions):
+    if err:
+        print("Offset commit failed: {}".format(err))
+
+# Applies the consumed events to order_service_db, on the consumer's single pool
+class OrderEventProcessor:
+    def __init__(self, pool, p, retry):
+        self.pool = pool
+        self.p = p
+        self.retry = retry
+        self.orders = OrderRepository(pool)
+        # Event type carried by each subscribed topic
+        self.event_types = {
+            KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG: UserRegistered,
+            KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC: PaymentSucceeded,
+            KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL: PaymentFailed,
+        }
+        # Order status set by each payment topic
+        self.payment_statuses = {
+            KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC: PAID,
+            KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL: FAILED,
+        }
+        # Payment events which did not move their order, by (target status, current status or 'missing')
+        self.rejected_transitions = Counter()
+        self.processed_events = ProcessedEventCache(CONSUMER_DEDUP_CACHE_SIZE)
+
+    # Send an event which cannot be processed to the DLQ, with the original payload when there is one. Completes once
+    # the broker has it (like RetryRouter.route), so the message's offset is only committed afterwards.
+    async def send_to_dlq(self, msg, error, payload=None):
+        message_for_dlq = DeadLetter(topic=msg.topic(), error=error, payload=payload)
+        await (await self.p.send( KAFKA_PRODUCER_TOPIC_DLQ, value=encode(message_for_dlq), key=msg.key() ))
+
+    # Decode and validate a message. Returns None when the event went to the DLQ instead.
+    async def decode_event(self, msg):
+        topic = msg.topic()
+        try:
+            data = decode(self.event_types[topic], msg.value())
+        except DecodeError as e:
+            await self.send_to_dlq(msg, str(e), payload=msg.value())
+            return None
+
+        # Validating here data.user_id / data.order_id is a UUID, in its canonical form for the idempotency keys
+        if topic == KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG:
+            try:
+                data.user_id = str(uuid.UUID(data.user_id))
+            except ValueError:
+                await self.send_to_dlq(msg, "User is not valid", payload=msg.value())
+                return None
+        else:
+            try:
+                data.order_id = normalize_order_id(data.order_id)
+            except ValueError:
+                await self.send_to_dlq(msg, "Order ID is not valid", payload=msg.value())
+                return None
+        return data
+
+    # Business key of an event: the user for a registration, the payment of the order for payment events
+    def event_id(self, topic, data):
+        if topic == KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG:
+            return (topic, data.user_id)
+        return (topic, data.order_id, data.payment_id)
+
+    # Count the payment events which did not move their order. Looking up why costs a round trip, only made when there are rejections.
+    async def count_rejected(self, status, rejected, connection=None):
+        if not rejected:
+            return
+        current_statuses = await self.orders.get_statuses(rejected, connection)
+        for order_id in rejected:
+            self.rejected_transitions[(status, current_statuses.get(order_id, 'missing'))] += 1
+        print(f"Rejected {len(rejected)} transitions to {status}, totals: {dict(self.rejected_transitions)}")
+
+    # Apply a decoded event
+    async def process_event(self, msg, data):
+        topic = msg.topic()
+        event_id = self.event_id(topic, data)
+        if self.processed_events.seen(event_id):
+            return
+
+        if topic == KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG: 
+            # Store user data for validation purposes
+            await self.pool.execute(
+                "INSERT INTO order_service_db.registered_users(user_id) VALUES($1) ON CONFLICT (user_id) DO NOTHING",
+                data.user_id
+            )
+        else:
+            # Update order status if it is still Pending. Handle payment failure, maybe notify the user, etc.
+            status = self.payment_statuses[topic]
+            applied, rejected = await apply_transition(self.pool, [data.order_id], status)
+            await self.count_rejected(status, rejected)
+        self.processed_events.add(event_id)
+
+    # Decode a message. Returns None when it went to the DLQ, or to the next retry tier when it could not be decoded
+    # for now (e.g. the schema registry or the DLQ is unreachable).
+    async def decode_or_retry(self, msg):
+        try:
+            return await self.decode_event(msg)
+        except Exception as e:
+            print(f"Failed to decode {msg.topic()} message: {e}")
+            await self.retry.route(msg, e)
+            return None
+
+    # Apply an event. A failure (e.g. a transient DB error) sends it to the next retry tier, or to the DLQ once
+    # every tier was tried, instead of stopping the consumer.
+    async def handle_event(self, msg, data):
+        try:
+            await self.process_event(msg, data)
+        except Exception as e:
+            print(f"Failed to process {msg.topic()} message: {e}")
+            await self.retry.route(msg, e)
+
+    # Process a message. Events which can never be decoded go to the DLQ right away.
+    async def handle_message(self, msg):
+        data = await self.decode_or_retry(msg)
+        if data is not None:
+            await self.handle_event(msg, data)
+
+    # Process a batch, when its transaction fails the events are applied again one at a time so only the failing ones
+    # are retried. Messages are decoded once, those already sent to the DLQ or to a retry tier are not sent again.
+    async def handle_batch(self, messages):
+        events = []
+        for msg in messages:
+            data = await self.decode_or_retry(msg)
+            if data is not None:
+                events.append((msg, data))
+        try:
+            await self.process_batch(events)
+        except Exception as e:
+            print(f"Failed to process a batch of {len(events)} events, processing them one at a time: {e}")
+            for msg, data in events:
+                await self.handle_event(msg, data)
+
+    # Process a batch of decoded (message, event) pairs: group them by topic and apply every group with a single
+    # statement, all in one transaction
+    async def process_batch(self, events):
+        user_ids = []
+        # First payment event of each order wins, like in the one message at a time mode where the order is no longer Pending afterwards
+        order_statuses = {}
+        # Duplicates, already processed or repeated within the batch, are dropped before the DB
+        event_ids = set()
+        for msg, data in events:
+            topic = msg.topic()
+            event_id = self.event_id(topic, data)
+            if event_id in event_ids or self.processed_events.seen(event_id):
+                continue
+            event_ids.add(event_id)
+            if topic == KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG:
+                user_ids.append(data.user_id)
+            else:
+                order_statuses.setdefault(data.order_id, self.payment_statuses[topic])
+
+        if not event_ids:
+            return
 
-    #Creating consumer from kafka
-    c = Consumer({
+        async with self.pool.acquire() as connection:
+            # Begin a transaction to ensure that database operations are atomic. 
+            async with connection.transaction():
+                if user_ids:
+                    await connection.execute(
+                        "INSERT INTO order_service_db.registered_users(user_id) SELECT unnest($1::uuid[]) ON CONFLICT (user_id) DO NOTHING",
+                        user_ids
+                    )
+                # One guarded UPDATE per target status moves the orders which are still Pending
+                for status in (PAID, FAILED):
+                    order_ids = [order_id for order_id, new_status in order_statuses.items() if new_status == status]
+                    if order_ids:
+                        applied, rejected = await apply_transition(connection, order_ids, status)
+                        await self.count_rejected(status, rejected, connection)
+
+        for event_id in event_ids:
+            self.processed_events.add(event_id)
+
+# Order Service consumer. instance_id overrides CONSUMER_INSTANCE_ID (static group membership).
+async def order_service_consumer(instance_id=None):
+
+    configure_codec(EVENT_WIRE_FORMAT, open_registry(SCHEMA_REGISTRY_URL))
+
+    batch_mode = CONSUMER_BATCH_SIZE > 1
+    instance_id = instance_id or CONSUMER_INSTANCE_ID
+
+    # Stop on SIGTERM / SIGINT after the in-flight messages are processed and their offsets committed
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    # Held while a batch is processed, so a rebalance waits for the batch before handing its partitions over
+    processing = asyncio.Lock()
+
+    # Partitions moving to another consumer: finish their queued messages, then give back their marked offsets for the
+    # consumer to commit before the move. Lost partitions already belong to another consumer, their queued messages
+    # and marked offsets are dropped without waiting, that consumer processes them again from its committed offsets.
+    async def on_revoke(topic_partitions, lost):
+        if lost:
+            workers.discard(topic_partitions)
+            committer.take_pending(topic_partitions)
+            return []
+        async with processing:
+            await workers.drain(topic_partitions, forget=True)
+        return committer.take_pending(topic_partitions)
+
+    consumer_conf = {
         'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
         'group.id': KAFKA_CONSUMER_GROUP_ID,
-        'auto.offset.reset': 'earliest'
-    })
-    c.subscribe( [KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG, KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC, KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL] )
+        'auto.offset.reset': 'earliest',
+        # Offsets are only committed by the OffsetCommitter, once the DB transaction of their messages (and of
+        # every earlier message of the partition) has committed
+        'enable.auto.commit': False,
+        'enable.auto.offset.store': False,
+        # Rebalances only move the partitions which change owner, the others keep being processed
+        'partition.assignment.strategy': 'cooperative-sticky',
+        'session.timeout.ms': CONSUMER_SESSION_TIMEOUT_MS,
+        'on_commit': commit_callback
+    }
+    if instance_id:
+        consumer_conf['group.instance.id'] = instance_id
+
+    #Creating consumer from kafka, librdkafka fetches in its own thread and never blocks the event loop
+    c = AsyncConsumer(
+        consumer_conf,
+        [KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG, KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC, KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL],
+        batch_size=CONSUMER_BATCH_SIZE if batch_mode else CONSUMER_FETCH_SIZE,
+        poll_timeout=CONSUMER_BATCH_TIMEOUT if batch_mode else CONSUMER_FETCH_TIMEOUT, queue_size=CONSUMER_QUEUE_SIZE,
+        on_revoke=on_revoke
+    )
 
     # creating a producer from Kafka 
     p_conf = {
@@ -66,86 +333,94 @@ async def order_service_consumer():
         'retry.backoff.ms': 60000,  # Wait for 60,000ms (1 minute) before retrying
         'enable.idempotence': True
     }
-    p = Producer(p_conf)
-
+    p = AsyncProducer(p_conf)
+    p.start()
 
+    retry_tiers = parse_retry_tiers(CONSUMER_RETRY_TOPICS)
     pool = await setup_db()
+    processor = OrderEventProcessor(pool, p, RetryRouter(p, retry_tiers, KAFKA_PRODUCER_TOPIC_DLQ))
+    committer = OffsetCommitter(c, commit_every=CONSUMER_COMMIT_EVERY, commit_interval=CONSUMER_COMMIT_INTERVAL)
+    workers = PartitionWorkers(
+        processor.handle_message, committer.mark,
+        concurrency=CONSUMER_CONCURRENCY, lanes_per_partition=CONSUMER_LANES_PER_PARTITION
+    )
+    c.start()
+    committer.start()
+
+    # The retry topics get their own consumer, in their own group
+    retry_task = None
+    if retry_tiers:
+        retry_conf = dict(consumer_conf, **{'group.id': CONSUMER_RETRY_GROUP_ID})
+        if instance_id:
+            retry_conf['group.instance.id'] = instance_id + '-retry'
+        retry_consumer = RetryConsumer(
+            retry_conf, [topic for topic, delay in retry_tiers], processor.handle_message,
+            commit_interval=CONSUMER_COMMIT_INTERVAL
+        )
+        retry_task = loop.create_task(retry_consumer.run(stopping))
 
     try:
-        while True:
-            msg = c.poll(1000)
-            if msg is None:
+        while not stopping.is_set():
+            # Without its retry consumer the failed messages would pile up unprocessed, so stop and let the
+            # process be restarted (consumer_launcher.py does)
+            if retry_task is not None and retry_task.done():
+                raise RuntimeError("Retry consumer stopped") from retry_task.exception()
+            messages = [msg for msg in await c.getmany(timeout=CONSUMER_BATCH_TIMEOUT) if not consumer_error(msg)]
+            if batch_mode:
+                async with processing:
+                    # Skip what a rebalance revoked while the batch was waiting for the lock
+                    messages = [msg for msg in messages if c.owns(msg)]
+                    if messages:
+                        await processor.handle_batch(messages)
+                        committer.mark_batch(batch_offsets(messages), len(messages))
                 continue
 
-            # Check if the message has an error
-            if msg.error():
-                if msg.error().code() == KafkaError._PARTITION_EOF:
-                    print("Reached end of partition")
-                else:
-                    print("Consumer error: {}".format(msg.error()))
-                continue
+            for msg in messages:
+                if c.owns(msg):
+                    await workers.submit(msg)
+            workers.raise_if_failed()
+        # Clean shutdown: let the workers finish what is already queued
+        await workers.drain()
+        workers.raise_if_failed()
+    finally:
+        stopping.set()
+        if retry_task is not None:
+            retry_error, = await asyncio.gather(retry_task, return_exceptions=True)
+            if isinstance(retry_error, Exception):
+                print(f"Retry consumer failed: {retry_error}")
+        await workers.close()
+        # Commit what is processed so far before leaving the group
+        await committer.close()
+        await c.close()
+        await p.close()
+        await pool.close()
 
-            topic = msg.topic()
-            data = msg.value().decode('utf-8')
-            data = data.replace("'", "\"")
-            data = json.loads(data)            
-            if topic == KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG: 
-                # Validating here data["user_id"] is not an empty string             
-                if not data["user_id"]:
-                    message_for_dlq = {"topic": KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG, "error": "User is not valid"}
-                    p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=str(message_for_dlq) )     
-                    p.flush()
-                    p.poll(0.5)
-                else:
-                    # Store user data for validation purposes
-                    async with pool.acquire() as connection:
-                        # Begin a transaction to ensure that database operations are atomic. 
-                        async with connection.transaction():    
-                            await connection.execute(
-                                "INSERT INTO order_service_db.registered_users(user_id) VALUES($1)",
-                                data["user_id"]
-                            )
-            elif topic == KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC:
-                # Validating here data["order_id"] is not an empty string  
-                if not data["order_id"]:
-                    message_for_dlq = {"topic": KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_SUCC, "error": "Order ID is not valid"}
-                    p.produce( KAFKA_PRODUCER_TOPIC_DLQ , value=str(message_for_dlq) )     
-                    p.flush()
-                    p.poll(0.5)
-                else:
-                    # Here we will check if order status is Pending then only we will process                             
-                    order_status = await check_order_status(data["order_id"]) 
-                    if order_status == 'Pending' :
-                        # Update order status
-                        async with pool.acquire() as connection:
-                            # Begin a transaction to ensure that database operations are atomic. 
-                            async with connection.transaction():    
-                                await connection.execute(
-                                    "UPDATE order_service_db.orders SET status='Paid' WHERE id=$1",
-                                    data["order_id"]
-                                )
-            elif topic == KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL:
-                # Validating here data["order_id"] is not an empty string  
-                if not data["order_id"]:
-                    message_for_dlq = {"topic": KAKFA_CONSUMER_SUBSCRIBE_TOPIC_PAY_FAIL, "error": "Order ID is not valid"}
-                    p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=str(message_for_dlq) )     
-                    p.flush()
-                    p.poll(0.5)
-                else:
-                    # Here we will check if order status is Pending then only we will process                   
-                    order_status = await check_order_status(data["order_id"]) 
-                    if order_status == 'Pending' : 
-                        # Handle payment failure, maybe notify the user, etc.
-                        async with pool.acquire() as connection:
-                            # Begin a transaction to ensure that database operations are atomic. 
-                            async with connection.transaction():    
-                                await connection.execute(
-                                    "UPDATE order_service_db.orders SET status='Failed' WHERE id=$1",
-                                    data["order_id"]
-                                )
-
-    except KeyboardInterrupt:
-        pass
+# Rebuild registered_users from the user-registration topic, then commit its end offsets for the consumer group
+async def replay_registered_users(from_offset=None, from_timestamp=None):
+    configure_codec(EVENT_WIRE_FORMAT, open_registry(SCHEMA_REGISTRY_URL))
+    pool = await setup_db()
+    try:
+        loaded, skipped = await replay_user_registrations(
+            pool, {'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS, 'group.id': KAFKA_CONSUMER_GROUP_ID},
+            KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG, from_offset=from_offset, from_timestamp=from_timestamp,
+            chunk_size=REPLAY_CHUNK_SIZE, merge_every=REPLAY_MERGE_EVERY, progress_interval=REPLAY_PROGRESS_INTERVAL
+        )
+        print(f"Replay done: {loaded} users loaded, {skipped} events skipped")
     finally:
-        c.close()
-asyncio.run(order_service_consumer())
\ No newline at end of file
+        await pool.close()
+
+async def main(args):
+    if args.replay:
+        await replay_registered_users(args.from_offset, args.from_timestamp)
+        if args.replay_only:
+            return
+    await order_service_consumer()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Order service consumer")
+    parser.add_argument('--replay', action='store_true',
+                        help="bulk-load registered_users from the user-registration topic first, while no other consumer of the group runs")
+    parser.add_argument('--from-offset', type=int, help="replay from this offset of every partition (default: the beginning)")
+    parser.add_argument('--from-timestamp', type=int, help="replay from this time, in epoch milliseconds")
+    parser.add_argument('--replay-only', action='store_true', help="exit after the replay instead of consuming")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,73 @@
+# Runs CONSUMER_PROCESSES order service consumers (consumer.py) in the same consumer group, one per process.
+# Every process gets a stable group.instance.id (static membership), <prefix>-<index>, so a restarted process
+# takes its partitions back without a rebalance, and the cooperative-sticky assignor only moves the partitions
+# of the processes which join or leave. Run it with: python consumer_launcher.py
+import asyncio
+import multiprocessing
+import signal
+import socket
+import time
+# This we are using to get environmental variables from .env file. Install this dependency by running this command : pip install python-decouple
+from decouple import config
+
+# Launcher Configuration
+CONSUMER_PROCESSES = config('CONSUMER_PROCESSES', default=4, cast=int)
+# Prefix of the group.instance.id of the processes, the host name by default. It must differ between hosts.
+CONSUMER_INSTANCE_PREFIX = config('CONSUMER_INSTANCE_PREFIX', default='') or socket.gethostname()
+# Seconds the processes get to finish their in-flight messages after SIGTERM before they are killed
+CONSUMER_SHUTDOWN_TIMEOUT = config('CONSUMER_SHUTDOWN_TIMEOUT', default=30.0, cast=float)
+# Seconds to wait before restarting a process which exited on its own
+CONSUMER_RESTART_DELAY = config('CONSUMER_RESTART_DELAY', default=5.0, cast=float)
+
+
+# Entry point of a consumer process
+def run_consumer(instance_id):
+    # Imported here so every process sets up its own consumer, producer and DB pool
+    from consumer import order_service_consumer
+    asyncio.run(order_service_consumer(instance_id))
+
+
+def start_process(instance_id):
+    process = multiprocessing.Process(target=run_consumer, args=(instance_id,), name=instance_id)
+    process.start()
+    print(f"Started consumer {instance_id} (pid {process.pid})")
+    return process
+
+
+def main():
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    instance_ids = [f"{CONSUMER_INSTANCE_PREFIX}-{index}" for index in range(CONSUMER_PROCESSES)]
+    processes = {instance_id: start_process(instance_id) for instance_id in instance_ids}
+
+    # Restart the processes which die, under the same instance id so they get their partitions back
+    while not stopping:
+        time.sleep(1)
+        for instance_id, process in processes.items():
+            if not stopping and not process.is_alive():
+                print(f"Consumer {instance_id} exited with code {process.exitcode}, restarting in {CONSUMER_RESTART_DELAY}s")
+                time.sleep(CONSUMER_RESTART_DELAY)
+                processes[instance_id] = start_process(instance_id)
+
+    # Forward the shutdown: each consumer drains its in-flight messages, commits their offsets and leaves the group
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + CONSUMER_SHUTDOWN_TIMEOUT
+    for instance_id, process in processes.items():
+        process.join(max(0, deadline - time.monotonic()))
+        if process.is_alive():
+            print(f"Consumer {instance_id} did not stop in time, killing it")
+            process.kill()
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import io
+import struct
+from typing import Optional
+# This library we are using to encode and decode the Kafka events. Install this dependency by running this command : pip install msgspec
+import msgspec
+# This library we are using for the optional Avro wire format. Install this dependency by running this command : pip install fastavro
+try:
+    import fastavro
+except ImportError:
+    fastavro = None
+# Registry failures which may go away (unreachable, timeout, 5xx)
+from schema_registry import SchemaRegistryUnavailable
+
+# Raised by decode() for malformed payloads and for payloads which don't match the event type
+DecodeError = msgspec.DecodeError
+# Raised by decode() when the schema of an Avro event cannot be fetched from the registry for now. The event may
+# well be valid, so it is not a DecodeError: consumers retry it instead of sending it to the DLQ.
+SchemaUnavailable = SchemaRegistryUnavailable
+
+
+############## Events published on the Kafka topics ###########
+# user-registration
+class UserRegistered(msgspec.Struct):
+    user_id: str
+    username: str
+    email: str
+
+# order-placed
+class OrderPlaced(msgspec.Struct):
+    order_id: str
+    total_price: float
+
+# Common payload of the payment-success and payment-failure topics
+class PaymentEvent(msgspec.Struct):
+    payment_id: str
+    order_id: str
+    amount: float
+    payment_gateway_response: str
+
+# payment-success
+class PaymentSucceeded(PaymentEvent):
+    pass
+
+# payment-failure
+class PaymentFailed(PaymentEvent):
+    pass
+
+# product-update
+class ProductChanged(msgspec.Struct):
+    product_id: str
+    name: str
+    price: float
+
+# dlq, payload holds the original message bytes when there is one
+class DeadLetter(msgspec.Struct):
+    topic: str
+    error: str
+    payload: Optional[bytes] = None
+
+
+EVENT_TYPES = (UserRegistered, OrderPlaced, PaymentSucceeded, PaymentFailed, ProductChanged, DeadLetter)
+
+
+############## Avro schemas used with the schema registry wire format ###########
+AVRO_NAMESPACE = 'ecommerce.events'
+
+# Fields are (name, type) or (name, type, default)
+def _avro_record(name, fields):
+    return {
+        'type': 'record', 'name': name, 'namespace': AVRO_NAMESPACE,
+        'fields': [dict(zip(('name', 'type', 'default'), field)) for field in fields],
+    }
+
+_payment_fields = [('payment_id', 'string'), ('order_id', 'string'), ('amount', 'double'), ('payment_gateway_response', 'string')]
+
+AVRO_SCHEMAS = {
+    UserRegistered: _avro_record('UserRegistered', [('user_id', 'string'), ('username', 'string'), ('email', 'string')]),
+    OrderPlaced: _avro_record('OrderPlaced', [('order_id', 'string'), ('total_price', 'double')]),
+    PaymentSucceeded: _avro_record('PaymentSucceeded', _payment_fields),
+    PaymentFailed: _avro_record('PaymentFailed', _payment_fields),
+    ProductChanged: _avro_record('ProductChanged', [('product_id', 'string'), ('name', 'string'), ('price', 'double')]),
+    DeadLetter: _avro_record('DeadLetter', [('topic', 'string'), ('error', 'string'), ('payload', ['null', 'bytes'], None)]),
+}
+
+# Confluent wire format: magic byte 0, big endian schema id, then the Avro binary body
+_MAGIC_BYTE = 0
+_FRAME_HEADER = struct.Struct('>bI')
+
+
+############## Codec state ###########
+_encoder = msgspec.json.Encoder()
+_decoders = {event_type: msgspec.json.Decoder(event_type) for event_type in EVENT_TYPES}
+
+_registry = None
+_avro_writers = {}        # event type -> (frame header, parsed schema), filled by configure('avro', ...)
+_avro_reader_schemas = {}  # event type -> parsed schema used to read any registered version, filled on first use
+_avro_writer_schemas = {}  # schema id -> parsed writer schema, filled on first sight of an id
+
+
+# Select the wire format of encode(). Call it once at startup, before the first event is produced.
+# 'json' (the default) encodes with msgspec. 'avro' registers every event schema under its record name
+# (RecordNameStrategy) and encodes with the registry framing; the registry is only contacted here.
+# Whatever the format, decode() reads both JSON and framed Avro payloads if a registry is given, so
+# producers and consumers can be switched over one at a time. fastavro is only needed to produce Avro,
+# or once a framed payload is received.
+def configure(wire_format='json', registry=None):
+    global _registry
+    if wire_format not in ('json', 'avro'):
+        raise ValueError(f"Unknown event wire format {wire_format!r}")
+    if wire_format == 'avro' and registry is None:
+        raise ValueError("The avro wire format needs a schema registry")
+    if wire_format == 'avro' and fastavro is None:
+        raise RuntimeError("The avro wire format needs fastavro: pip install fastavro")
+
+    _registry = registry
+    _avro_writers.clear()
+    _avro_writer_schemas.clear()
+    if wire_format == 'avro':
+        for event_type, schema in AVRO_SCHEMAS.items():
+            schema_id = registry.register(f"{AVRO_NAMESPACE}.{schema['name']}", schema)
+            _avro_writers[event_type] = (_FRAME_HEADER.pack(_MAGIC_BYTE, schema_id), _reader_schema(event_type))
+
+# Parsed schema of the event type, used to write it and to read any registered version of it
+def _reader_schema(event_type):
+    if event_type not in _avro_reader_schemas:
+        _avro_reader_schemas[event_type] = fastavro.parse_schema(AVRO_SCHEMAS[event_type])
+    return _avro_reader_schemas[event_type]
+
+
+# Encode an event to the bytes which are sent to Kafka
+def encode(event):
+    if _avro_writers:
+        header, schema = _avro_writers[type(event)]
+        buffer = io.BytesIO()
+        buffer.write(header)
+        fastavro.schemaless_writer(buffer, schema, msgspec.structs.asdict(event))
+        return buffer.getvalue()
+    return _encoder.encode(event)
+
+# Decode a Kafka message value (bytes or memoryview, no copy is made for JSON) into the given event type.
+# Types are checked strictly, e.g. a string order total or a missing order_id raises DecodeError, as does a
+# message without a value (a tombstone).
+def decode(event_type, data):
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        raise DecodeError(f"Expected the event as bytes, got {type(data).__name__}")
+    # A JSON document never starts with a zero byte, so the framing tells the two formats apart
+    if data[:1] == b'\x00':
+        return _decode_avro(event_type, data)
+    return _decoders[event_type].decode(data)
+
+def _decode_avro(event_type, data):
+    if _registry is None:
+        raise DecodeError("Avro encoded event received but no schema registry is configured")
+    if fastavro is None:
+        # Not the event's fault, so not a DecodeError: it is retried once fastavro is installed
+        raise RuntimeError("Avro encoded event received but fastavro is not installed: pip install fastavro")
+    try:
+        _, schema_id = _FRAME_HEADER.unpack_from(data)
+        if schema_id not in _avro_writer_schemas:
+            _avro_writer_schemas[schema_id] = fastavro.parse_schema(_registry.get_schema(schema_id))
+        record = fastavro.schemaless_reader(
+            io.BytesIO(memoryview(data)[_FRAME_HEADER.size:]),
+            _avro_writer_schemas[schema_id],
+            _reader_schema(event_type)
+        )
+    except (DecodeError, SchemaUnavailable):
+        raise
+    except Exception as e:
+        raise DecodeError(f"Invalid Avro event: {e}") from e
+    return msgspec.convert(record, event_type)
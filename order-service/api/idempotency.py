@@ -0,0 +1,27 @@
+from collections import OrderedDict
+
+
+# Bounded LRU of the ids of recently processed events. Kafka delivers at least once, so retries and
+# rebalances hand the consumer events it has already applied; those found here are skipped without a DB
+# round trip. The cache is per process and forgets the oldest ids, the unique constraints and guarded
+# updates in the database still make a duplicate which is no longer cached a no-op.
+class ProcessedEventCache:
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._event_ids = OrderedDict()
+        self.hits = 0
+
+    # True if the event was already processed
+    def seen(self, event_id):
+        if event_id in self._event_ids:
+            self._event_ids.move_to_end(event_id)
+            self.hits += 1
+            return True
+        return False
+
+    # Remember an event once its DB transaction has committed
+    def add(self, event_id):
+        self._event_ids[event_id] = None
+        self._event_ids.move_to_end(event_id)
+        if len(self._event_ids) > self.maxsize:
+            self._event_ids.popitem(last=False)
@@ -0,0 +1,127 @@
+import asyncio
+import concurrent.futures
+import threading
+# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
+from confluent_kafka import Consumer, TopicPartition
+
+# How often the fetch thread checks for close() while it waits for room in the queue (seconds)
+STOP_CHECK_INTERVAL = 0.5
+
+
+# Asyncio adapter around the confluent_kafka Consumer.
+# consume() blocks, so it runs in a dedicated thread which hands every fetched chunk of messages to the
+# event loop through a bounded asyncio.Queue. Fetching overlaps with the awaited DB work, and when the
+# processing falls behind the queue fills up and the thread stops fetching until there is room again.
+# on_revoke(topic_partitions, lost) is a coroutine run on the loop when partitions are taken away, while the
+# rebalance waits for it. It should finish the in-flight work of those partitions and return the offsets
+# (TopicPartition list) to commit before they move to another consumer. Nothing is committed for lost partitions.
+class AsyncConsumer:
+    def __init__(self, config, topics, batch_size=100, poll_timeout=1.0, queue_size=10, on_revoke=None):
+        self._consumer = Consumer(config)
+        self._topics = topics
+        self._batch_size = batch_size
+        self._poll_timeout = poll_timeout
+        self._queue_size = queue_size
+        self._on_revoke = on_revoke
+        self._assigned = set()  # (topic, partition) currently owned
+        self._queue = None
+        self._loop = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    # Subscribe and start the fetch thread. Must be called from the running loop.
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._consumer.subscribe(
+            self._topics, on_assign=self._assign_callback, on_revoke=self._revoke_callback, on_lost=self._lost_callback
+        )
+        self._thread = threading.Thread(target=self._fetch, name='kafka-consumer-fetch', daemon=True)
+        self._thread.start()
+
+    def _fetch(self):
+        while not self._stopping.is_set():
+            messages = self._consumer.consume(num_messages=self._batch_size, timeout=self._poll_timeout)
+            if not messages:
+                continue
+            put = asyncio.run_coroutine_threadsafe(self._queue.put(messages), self._loop)
+            # Wait for room in the queue (backpressure), but give up when the consumer is closed
+            while not self._stopping.is_set():
+                try:
+                    put.result(timeout=STOP_CHECK_INTERVAL)
+                    break
+                except concurrent.futures.TimeoutError:
+                    continue
+            else:
+                put.cancel()
+
+    # Rebalance callbacks, called from the fetch thread (or from close()). With the cooperative-sticky assignor
+    # they only carry the partitions which move, and the client applies the incremental (un)assignment afterwards.
+    def _assign_callback(self, consumer, partitions):
+        self._assigned.update((tp.topic, tp.partition) for tp in partitions)
+        if partitions:
+            print("Assigned partitions: {}".format(sorted(self._assigned)))
+
+    def _revoke_callback(self, consumer, partitions, lost=False):
+        revoked = {(tp.topic, tp.partition) for tp in partitions}
+        self._assigned -= revoked
+        if not revoked or self._on_revoke is None:
+            return
+        try:
+            offsets = asyncio.run_coroutine_threadsafe(self._on_revoke(revoked, lost), self._loop).result()
+            if offsets and not lost:
+                consumer.commit(offsets=offsets, asynchronous=False)
+        except Exception as e:
+            print("Failed to hand over partitions {}: {}".format(sorted(revoked), e))
+        print("{} partitions: {}".format("Lost" if lost else "Revoked", sorted(revoked)))
+
+    def _lost_callback(self, consumer, partitions):
+        self._revoke_callback(consumer, partitions, lost=True)
+
+    # Whether the message's partition is still owned. Chunks fetched before a rebalance may hold messages of revoked partitions.
+    def owns(self, msg):
+        return msg.error() is not None or (msg.topic(), msg.partition()) in self._assigned
+
+    # Wait for the next chunk of messages (up to batch_size, in partition order). Messages may carry an error().
+    # With a timeout, returns an empty list when nothing arrives in time.
+    async def getmany(self, timeout=None):
+        try:
+            messages = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        return [msg for msg in messages if self.owns(msg)]
+
+    # Stop fetching the message's partition and rewind it to the message, which is fetched again after resume()
+    def pause_at(self, msg):
+        partition = TopicPartition(msg.topic(), msg.partition(), msg.offset())
+        self._consumer.pause([partition])
+        self._consumer.seek(partition)
+
+    def resume(self, topic, partition):
+        if (topic, partition) in self._assigned:
+            self._consumer.resume([TopicPartition(topic, partition)])
+
+    # Queue a commit of the given offsets (TopicPartition list), librdkafka sends it in the background
+    def commit_async(self, offsets):
+        self._consumer.commit(offsets=offsets, asynchronous=True)
+
+    # Commit the given offsets and wait for the broker, without blocking the loop
+    async def commit(self, offsets):
+        await self._loop.run_in_executor(None, lambda: self._consumer.commit(offsets=offsets, asynchronous=False))
+
+    # Stop the fetch thread, then close the consumer (which commits and leaves the group) outside the loop
+    async def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            await self._loop.run_in_executor(None, self._thread.join)
+            self._thread = None
+        await self._loop.run_in_executor(None, self._consumer.close)
+
+
+# Offsets to commit once the messages are processed: the offset after the last message of each partition
+def batch_offsets(messages):
+    next_offsets = {}
+    for msg in messages:
+        key = (msg.topic(), msg.partition())
+        next_offsets[key] = max(next_offsets.get(key, 0), msg.offset() + 1)
+    return [TopicPartition(topic, partition, offset) for (topic, partition), offset in next_offsets.items()]
@@ -0,0 +1,75 @@
+import asyncio
+# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
+from confluent_kafka import TopicPartition
+
+
+# Manual offset commits for a consumer running with 'enable.auto.commit': False.
+# The caller marks an offset only after the DB transaction of the messages before it has committed. Marked
+# offsets are coalesced per partition and committed asynchronously every commit_every messages or every
+# commit_interval seconds, so there is no synchronous commit per message and at most that much is re-run
+# after a crash (at-least-once).
+class OffsetCommitter:
+    def __init__(self, consumer, commit_every=1000, commit_interval=1.0):
+        self._consumer = consumer
+        self._commit_every = commit_every
+        self._commit_interval = commit_interval
+        self._pending = {}  # (topic, partition) -> next offset to consume
+        self._uncommitted = 0
+        self._task = None
+
+    # Start committing every commit_interval seconds
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._commit_interval)
+            self.commit()
+
+    # Record that `count` messages are durable and the partition can resume from `offset`
+    def mark(self, topic, partition, offset, count=1):
+        key = (topic, partition)
+        self._pending[key] = max(self._pending.get(key, 0), offset)
+        self._uncommitted += count
+        if self._uncommitted >= self._commit_every:
+            self.commit()
+
+    # Same as mark() for the offsets (TopicPartition list) of a batch of `count` messages
+    def mark_batch(self, offsets, count):
+        for offset in offsets:
+            key = (offset.topic, offset.partition)
+            self._pending[key] = max(self._pending.get(key, 0), offset.offset)
+        self._uncommitted += count
+        if self._uncommitted >= self._commit_every:
+            self.commit()
+
+    # Remove and return the marked offsets (of the given partitions, or all of them) as a TopicPartition list,
+    # e.g. to commit them from a rebalance callback
+    def take_pending(self, topic_partitions=None):
+        keys = [key for key in self._pending if topic_partitions is None or key in topic_partitions]
+        offsets = [TopicPartition(topic, partition, self._pending.pop((topic, partition))) for topic, partition in keys]
+        if topic_partitions is None:
+            self._uncommitted = 0
+        return offsets
+
+    # Commit the marked offsets in the background, errors are reported through the consumer's on_commit callback
+    def commit(self):
+        offsets = self.take_pending()
+        if offsets:
+            self._consumer.commit_async(offsets)
+
+    # Commit the marked offsets (of the given partitions, or all of them) and wait for the broker, e.g. on shutdown
+    async def flush(self, topic_partitions=None):
+        offsets = self.take_pending(topic_partitions)
+        if offsets:
+            await self._consumer.commit(offsets)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
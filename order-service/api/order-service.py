@@ -1,11 +1,24 @@
+import asyncio
 from sanic import Sanic
-from sanic.response import json
+from sanic.response import json, raw
 # This library we are using to get environmental variables from .env file. Install this dependency by running this command : pip install python-decouple
 from decouple import config 
 # This library we are using to connect API with database postgresql. Install this dependency by running this command : pip install asyncpg
 import asyncpg
-# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
-from confluent_kafka import Producer
+# Asyncio wrapper around the confluent_kafka Producer. Install this dependency by running this command : pip install confluent_kafka
+from kafka_producer import AsyncProducer
+# Relay which publishes the outbox table to Kafka
+from outbox_relay import run_outbox_relay
+# In-memory index of the registered users
+from user_index import RegisteredUserIndex
+# Order, line items and outbox event written in one statement
+from order_placement import place_order as place_order_statement
+# Opt-in group commit of the orders placed concurrently
+from order_writer import GroupCommitWriter
+# Typed encoding and decoding of the Kafka events. Install this dependency by running this command : pip install msgspec
+from event_codec import configure as configure_codec
+# Client for the Confluent schema registry used by the avro wire format
+from schema_registry import open_registry
 # Import the authenticate and authenticate_middleware functions
 from authentication import authenticate, authenticate_middleware
 
@@ -19,6 +32,21 @@ DB_NAME = config('DB_NAME')
 KAFKA_BOOTSTRAP_SERVERS = config('KAFKA_BOOTSTRAP_SERVERS')
 KAFKA_PRODUCER_TOPIC = config('KAFKA_PRODUCER_TOPIC')
 KAFKA_PRODUCER_TOPIC_DLQ = config('KAFKA_PRODUCER_TOPIC_DLQ')
+KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG = config('KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG')
+# Outbox Configuration, disable the in-process relay when running standalone relays (python outbox_relay.py)
+OUTBOX_RELAY_ENABLED = config('OUTBOX_RELAY_ENABLED', default=True, cast=bool)
+# Event Configuration, EVENT_WIRE_FORMAT is 'json' or 'avro' (schema registry framing)
+EVENT_WIRE_FORMAT = config('EVENT_WIRE_FORMAT', default='json')
+SCHEMA_REGISTRY_URL = config('SCHEMA_REGISTRY_URL', default='')
+# User Index Configuration, with it disabled every order checks its user in the DB
+USER_INDEX_ENABLED = config('USER_INDEX_ENABLED', default=True, cast=bool)
+# Order Items Configuration, carts with at least this many items are written with COPY
+ORDER_ITEMS_COPY_THRESHOLD = config('ORDER_ITEMS_COPY_THRESHOLD', default=100, cast=int)
+# Group Commit Configuration, when enabled the orders placed within ORDER_GROUP_COMMIT_MAX_WAIT_MS of each other
+# (up to ORDER_GROUP_COMMIT_MAX_BATCH of them) are written in one transaction
+ORDER_GROUP_COMMIT_ENABLED = config('ORDER_GROUP_COMMIT_ENABLED', default=False, cast=bool)
+ORDER_GROUP_COMMIT_MAX_BATCH = config('ORDER_GROUP_COMMIT_MAX_BATCH', default=100, cast=int)
+ORDER_GROUP_COMMIT_MAX_WAIT_MS = config('ORDER_GROUP_COMMIT_MAX_WAIT_MS', default=5.0, cast=float)
 
 # API Configuration
 API_HOST = config('API_HOST')
@@ -43,19 +71,46 @@ p_conf = {
     'retry.backoff.ms': 60000,  # Wait for 60,000ms (1 minute) before retrying
     'enable.idempotence': True
 }
-p = Producer(p_conf)
+p = AsyncProducer(p_conf)
 
 # Register the middleware
 @app.middleware('request')(authenticate_middleware)
 
-# Register the setup_db function to be executed before starting the server
+# Register the event codec, the setup_db function, the producer poll task, the outbox relay, the user index and the order writer to be executed before starting the server
 @app.listener('before_server_start')
 async def before_server_start(app, loop):
+    # Schemas are registered here once, producing an event never calls the schema registry
+    configure_codec(EVENT_WIRE_FORMAT, open_registry(SCHEMA_REGISTRY_URL))
     await setup_db(app)
-
-# Register the close_db function to be executed after stopping the server
+    p.start()
+    app.ctx.outbox_relay = loop.create_task(run_outbox_relay(app.ctx.db, p, KAFKA_PRODUCER_TOPIC_DLQ)) if OUTBOX_RELAY_ENABLED else None
+    app.ctx.user_index = None
+    if USER_INDEX_ENABLED:
+        app.ctx.user_index = RegisteredUserIndex(app.ctx.db)
+        await app.ctx.user_index.start({'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS}, KAKFA_CONSUMER_SUBSCRIBE_TOPIC_USR_REG)
+    app.ctx.order_writer = None
+    if ORDER_GROUP_COMMIT_ENABLED:
+        app.ctx.order_writer = GroupCommitWriter(
+            app.ctx.db, KAFKA_PRODUCER_TOPIC,
+            max_batch_size=ORDER_GROUP_COMMIT_MAX_BATCH, max_wait=ORDER_GROUP_COMMIT_MAX_WAIT_MS / 1000,
+            copy_threshold=ORDER_ITEMS_COPY_THRESHOLD
+        )
+        app.ctx.order_writer.start()
+
+# Register the close_db function to be executed after stopping the server, outstanding messages are flushed first
 @app.listener('after_server_stop')
 async def after_server_stop(app, loop):
+    if app.ctx.order_writer:
+        await app.ctx.order_writer.close()
+    if app.ctx.user_index:
+        await app.ctx.user_index.close()
+    if app.ctx.outbox_relay:
+        app.ctx.outbox_relay.cancel()
+        try:
+            await app.ctx.outbox_relay
+        except asyncio.CancelledError:
+            pass
+    await p.close()
     await close_db(app)
 
 ############## All the functions code starts from here ###########
@@ -68,67 +123,28 @@ async def setup_db(app):
 async def close_db(app):
     await app.ctx.db.close()
 
-# This function is a callback function from kafka producer method used to identify the errors and report to DLQ for further investigation
-def delivery_callback(err, msg):
-    try:
-        if err:
-            data = msg.value().decode('utf-8')
-            data = data.replace("'", "\"")
-            data = json.loads(data) 
-            data['topic'] = msg.topic()
-            data['error'] = str(err)            
-            p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=str(data) )
-            print(f"Failed to deliver message: {err}. Message might be retried.")
-        else:                
-            print(f"Message delivered to {msg.topic()} [{msg.partition()}]")
-    except Exception as e:       
-        print(json({'error': str(e)})) 
-
-# Checkif user exist or not
+# Checkif user exist or not in the in-memory user index. Without the index the placement statement is the only check.
 
 async def check_user(user_id):
     try:
-        async with app.ctx.db.acquire() as connection:                 
-            query = "SELECT EXISTS (SELECT 1 FROM order_service_db.registered_users WHERE user_id = $1)"
-            rows = await connection.fetchval(query, user_id)            
-        return rows
+        if app.ctx.user_index:
+            return await app.ctx.user_index.exists(user_id)
+        return True
     except Exception as e:           
         return False
 
 
-# Create order function that returns order ID
-async def create_order(user_id, total_price):
-    try: 
-        async with app.ctx.db.acquire() as connection:  
-            # Begin a transaction to ensure that database operations are atomic. 
-            async with connection.transaction():      
-                order_id = await connection.fetchval(
-                    "INSERT INTO order_service_db.orders(user_id, total_price) VALUES($1, $2) RETURNING id",
-                    user_id, total_price
-                )                  
-        return order_id
-    except Exception as e:             
-        return False
-
-# Create order_item function to insert products corrosponding to order_id
-async def create_order_items(order_id, products):
-    try: 
-        async with app.ctx.db.acquire() as connection:   
-            # Perform the bulk insert
-            # Begin a transaction to ensure that database operations are atomic. 
-            async with connection.transaction():         
-                for row in products:                    
-                    product_id = row['product_id']
-                    quantity = row['quantity']
-                    price = row['price']
-                    # Execute the INSERT statement
-                    await connection.execute('''
-                        INSERT INTO order_service_db.order_items (order_id, product_id, quantity, price)
-                        VALUES ($1, $2, $3, $4)
-                    ''', order_id, product_id, quantity, price)           
-        return True
-    except Exception as e:          
-        return json({"message": "Error"}, status=201)
+# Create order function that returns order ID, or None when the user is not registered.
+# The order, its items and its order-placed event (in the outbox table, published by the relay) are one statement
+# on one connection, so they commit together or not at all. The event is keyed by order id, like the payment events of the order.
+async def create_order(user_id, total_price, products):
+    # With group commit the order shares its transaction with the orders placed at the same time
+    if app.ctx.order_writer:
+        return await app.ctx.order_writer.place(user_id, total_price, products)
+    async with app.ctx.db.acquire() as connection:
+        return await place_order_statement(
+            connection, KAFKA_PRODUCER_TOPIC, user_id, total_price, products, ORDER_ITEMS_COPY_THRESHOLD
+        )
     
 
 
@@ -151,16 +167,8 @@ async def place_order(request):
             products = ordered_data.get('products')
             # Here we will check the order validity by checking the user is present in the system or not
             user_exist = await check_user(user_id)            
-            if user_exist:
-                order_id = await create_order(user_id, total_price) 
-                if order_id :                
-                    status = await create_order_items(order_id, products)
-                                       
-                    # Sending message to topic
-                    order_data_for_producer = {"order_id": str(order_id), "total_price": total_price}
-                    p.produce( KAFKA_PRODUCER_TOPIC, value=str(order_data_for_producer), callback=delivery_callback )     
-                    p.flush()
-                    p.poll(0.5)
+            order_id = await create_order(user_id, total_price, products) if user_exist else None
+            if order_id:
                 return json({"message": "Order created successfully","id": str(order_id)}, status=201)
             else:
                 return json({"message": "User not found. So order cannot be created"}, status=201)
@@ -168,26 +176,41 @@ async def place_order(request):
         print(str(e))  
         return json({"message": "Error"+str(e)}, status=201)
     
+# The whole response body of the order detail is built by Postgres, the line items are aggregated with json_agg.
+# asyncpg prepares each query once per connection, the JSON text goes into the response as is.
+ORDER_DETAIL_FIELDS = """
+    'id', o.id,
+    'user_id', o.user_id,
+    'total_price', o.total_price,
+    'status', o.status
+"""
+ORDER_ITEMS_FIELD = """,
+    'items', (
+        SELECT coalesce(json_agg(json_build_object(
+            'id', i.id, 'product_id', i.product_id, 'quantity', i.quantity, 'price', i.price
+        ) ORDER BY i.line_no, i.id), '[]'::json)
+        FROM order_service_db.order_items i WHERE i.order_id = o.id
+    )
+"""
+ORDER_DETAIL_QUERY = """
+    SELECT json_build_object('message', 'Order found', 'data', json_build_object({fields}))::text
+    FROM order_service_db.orders o WHERE o.id = $1
+"""
+GET_ORDER = ORDER_DETAIL_QUERY.format(fields=ORDER_DETAIL_FIELDS)
+GET_ORDER_WITH_ITEMS = ORDER_DETAIL_QUERY.format(fields=ORDER_DETAIL_FIELDS + ORDER_ITEMS_FIELD)
+
+# Fetch Order by order_id, with its line items for ?include=items
 @app.get("/orders/<order_id>")
 async def get_order(request, order_id):
-    # Fetch Order by order_id
     try:        
         if not order_id:
             return  json({"message": "Enter product id"}, status=201)  
         elif 32 <= len(order_id) <= 36:        
-            async with app.ctx.db.acquire() as connection:    
-                query = "SELECT * FROM order_service_db.orders WHERE id = $1"
-                order_info = await connection.fetch(query, order_id)                                
-                if not order_info: 
-                    return  json({"message": "Order not found"}, status=201)    
-                else:                                   
-                    data = {
-                        'id': str(order_info[0]['id']),
-                        'user_id': str(order_info[0]['user_id']),
-                        'total_price': order_info[0]['total_price'], 
-                        'status': order_info[0]['status'],                   
-                    }                    
-                    return  json({"message": "Order found","data": data}, status=201) 
+            query = GET_ORDER_WITH_ITEMS if 'items' in request.args.get('include', '').split(',') else GET_ORDER
+            body = await app.ctx.db.fetchval(query, order_id)
+            if body is None: 
+                return  json({"message": "Order not found"}, status=201)    
+            return raw(body.encode('utf-8'), status=201, content_type='application/json')
         else:
              return  json({"message": "ID length must be between 32..36 characters"}, status=201) 
                 
@@ -0,0 +1,32 @@
+from decimal import Decimal
+
+# Carts with at least this many line items are written with COPY, smaller ones with one INSERT ... unnest statement
+COPY_THRESHOLD = 100
+
+# One statement and one round trip for every line item of the order, whatever the cart size
+INSERT_ITEMS = """
+    INSERT INTO order_service_db.order_items (order_id, product_id, quantity, price, line_no)
+    SELECT $1, * FROM unnest($2::uuid[], $3::integer[], $4::numeric[]) WITH ORDINALITY
+"""
+ITEM_COLUMNS = ['order_id', 'product_id', 'quantity', 'price', 'line_no']
+
+
+# (product_id, quantity, price) of every line item, typed for the binary protocol. Raises on a malformed item.
+def item_rows(products):
+    return [(str(row['product_id']), int(row['quantity']), Decimal(str(row['price']))) for row in products]
+
+
+# Write the line items of the order on the connection (inside the caller's transaction), in a single round trip.
+# line_no keeps their position in the cart.
+async def insert_order_items(connection, order_id, products, copy_threshold=COPY_THRESHOLD):
+    rows = item_rows(products)
+    if not rows:
+        return
+    if len(rows) >= copy_threshold:
+        await connection.copy_records_to_table(
+            'order_items', schema_name='order_service_db', columns=ITEM_COLUMNS,
+            records=[(order_id,) + row + (line_no,) for line_no, row in enumerate(rows, 1)]
+        )
+        return
+    product_ids, quantities, prices = zip(*rows)
+    await connection.execute(INSERT_ITEMS, order_id, list(product_ids), list(quantities), list(prices))
@@ -0,0 +1,45 @@
+import uuid
+# Bulk insert of the order line items
+from order_items import COPY_THRESHOLD, insert_order_items, item_rows
+from event_codec import OrderPlaced, encode
+
+# Places an order as one statement: the order is only inserted when the user is registered, and its line items and
+# its outbox event are inserted with it, so everything commits (or fails) together in one round trip.
+# The order id is generated by the caller so the event payload can be encoded before the statement.
+PLACE_ORDER = """
+    WITH new_order AS (
+        INSERT INTO order_service_db.orders(id, user_id, total_price)
+        SELECT $1::uuid, $2::uuid, $3
+        WHERE EXISTS (SELECT 1 FROM order_service_db.registered_users WHERE user_id = $2::uuid)
+        RETURNING id
+    ), items AS (
+        INSERT INTO order_service_db.order_items(order_id, product_id, quantity, price, line_no)
+        SELECT new_order.id, item.product_id, item.quantity, item.price, item.line_no
+        FROM new_order, unnest($4::uuid[], $5::integer[], $6::numeric[]) WITH ORDINALITY AS item(product_id, quantity, price, line_no)
+    ), event AS (
+        INSERT INTO order_service_db.outbox(topic, event_key, payload)
+        SELECT $7, new_order.id::text, $8 FROM new_order
+    )
+    SELECT EXISTS (SELECT 1 FROM new_order)
+"""
+
+
+# Place the order on the connection, returns its id, or None when the user is not registered.
+# Carts of copy_threshold items or more get their line items COPYed after the statement, in the same transaction.
+async def place_order(connection, topic, user_id, total_price, products, copy_threshold=COPY_THRESHOLD):
+    order_id = uuid.uuid4()
+    rows = item_rows(products)
+    payload = encode(OrderPlaced(order_id=str(order_id), total_price=total_price))
+
+    if len(rows) < copy_threshold:
+        product_ids, quantities, prices = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+        placed = await connection.fetchval(
+            PLACE_ORDER, order_id, user_id, total_price, product_ids, quantities, prices, topic, payload
+        )
+        return order_id if placed else None
+
+    async with connection.transaction():
+        placed = await connection.fetchval(PLACE_ORDER, order_id, user_id, total_price, [], [], [], topic, payload)
+        if placed:
+            await insert_order_items(connection, order_id, products, copy_threshold=0)
+    return order_id if placed else None
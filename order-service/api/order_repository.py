@@ -0,0 +1,15 @@
+# Order queries used by the consumer (status changes go through order_state.py). They all run on the consumer's
+# single pool, or on the connection of the caller's transaction when one is given. The queries are constants so
+# asyncpg prepares each of them once per connection and reuses the prepared statement from its statement cache.
+
+GET_STATUSES = "SELECT id, status FROM order_service_db.orders WHERE id = ANY($1::uuid[])"
+
+
+class OrderRepository:
+    def __init__(self, pool):
+        self.pool = pool
+
+    # Statuses of many orders in one round trip, as {order_id: status}. Unknown orders are left out.
+    async def get_statuses(self, order_ids, connection=None):
+        rows = await (connection or self.pool).fetch(GET_STATUSES, list(order_ids))
+        return {str(row['id']): row['status'] for row in rows}
@@ -0,0 +1,42 @@
+import uuid
+
+# Order state machine of order_service_db.orders.status (the ORDER_STATUS enum)
+PENDING = 'Pending'
+PAID = 'Paid'
+FAILED = 'Failed'
+
+# Statuses an order can move to. Payment events only ever move a Pending order.
+TRANSITIONS = {
+    PAID: PENDING,
+    FAILED: PENDING,
+}
+
+# Checking the current status and changing it is one guarded statement, so two payment events
+# of one order can never both apply, whatever the interleaving of the consumers
+APPLY_TRANSITION = """
+    UPDATE order_service_db.orders SET status = $2
+    WHERE id = ANY($1::uuid[]) AND status = $3
+    RETURNING id
+"""
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+# Canonical string form of an order id, raises ValueError for anything which is not a UUID
+def normalize_order_id(order_id):
+    return str(uuid.UUID(order_id))
+
+
+# Move the orders to the status with one guarded UPDATE, on a pool or on the connection of the caller's transaction.
+# Order ids must be normalized. Returns (applied, rejected): the ids which moved and those which did not because
+# the order is missing or no longer in the source status.
+async def apply_transition(connection, order_ids, status):
+    if status not in TRANSITIONS:
+        raise InvalidTransition(f"Orders cannot move to {status}")
+    order_ids = list(order_ids)
+    rows = await connection.fetch(APPLY_TRANSITION, order_ids, status, TRANSITIONS[status])
+    applied = {str(row['id']) for row in rows}
+    rejected = [order_id for order_id in order_ids if order_id not in applied]
+    return applied, rejected
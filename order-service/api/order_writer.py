@@ -0,0 +1,145 @@
+import asyncio
+import uuid
+# Bulk insert of the order line items and the single order placement statement
+from order_items import COPY_THRESHOLD, item_rows
+from order_placement import place_order
+from event_codec import OrderPlaced, encode
+
+# Places a whole batch of orders as one statement, like order_placement.PLACE_ORDER does for one order: only the
+# orders of registered users are inserted, with their line items and their outbox events. Returns the inserted ids.
+PLACE_ORDERS = """
+    WITH input AS (
+        SELECT * FROM unnest($1::uuid[], $2::uuid[], $3::numeric[], $4::bytea[]) AS o(id, user_id, total_price, payload)
+    ), new_orders AS (
+        INSERT INTO order_service_db.orders(id, user_id, total_price)
+        SELECT o.id, o.user_id, o.total_price FROM input o
+        WHERE EXISTS (SELECT 1 FROM order_service_db.registered_users r WHERE r.user_id = o.user_id)
+        RETURNING id
+    ), items AS (
+        INSERT INTO order_service_db.order_items(order_id, product_id, quantity, price, line_no)
+        SELECT i.order_id, i.product_id, i.quantity, i.price, i.line_no
+        FROM unnest($5::uuid[], $6::uuid[], $7::integer[], $8::numeric[], $9::integer[]) AS i(order_id, product_id, quantity, price, line_no)
+        JOIN new_orders ON new_orders.id = i.order_id
+    ), events AS (
+        INSERT INTO order_service_db.outbox(topic, event_key, payload)
+        SELECT $10, o.id::text, o.payload FROM input o JOIN new_orders ON new_orders.id = o.id
+    )
+    SELECT id FROM new_orders
+"""
+
+
+# An order waiting for the next group commit, its future gets the order id (None when the user is not registered)
+class PendingOrder:
+    def __init__(self, user_id, total_price, products):
+        self.id = uuid.uuid4()
+        self.user_id = uuid.UUID(str(user_id))
+        self.total_price = total_price
+        self.products = products
+        self.rows = item_rows(products)
+        self.payload = encode(OrderPlaced(order_id=str(self.id), total_price=total_price))
+        self.future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, order_id):
+        if not self.future.done():
+            self.future.set_result(order_id)
+
+    def fail(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+# Group commit of the orders placed concurrently. place() queues the order and waits, a collector task writes the
+# queued orders every max_wait seconds or max_batch_size orders, whichever comes first, as one statement in one
+# transaction, so many orders share one commit (and one fsync). Up to max_in_flight batches are written at once.
+# copy_threshold applies to the orders placed one by one when a batch fails, as in order_placement.place_order.
+class GroupCommitWriter:
+    def __init__(self, pool, topic, max_batch_size=100, max_wait=0.005, max_in_flight=4, copy_threshold=COPY_THRESHOLD):
+        self._pool = pool
+        self._topic = topic
+        self._copy_threshold = copy_threshold
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._queue = asyncio.Queue()
+        self._flushes = set()
+        self._batch = []  # orders taken from the queue by the collector, not handed to a flush yet
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    # Place an order, returns its id, or None when the user is not registered. Malformed items raise right away.
+    async def place(self, user_id, total_price, products):
+        order = PendingOrder(user_id, total_price, products)
+        self._queue.put_nowait(order)
+        return await order.future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._in_flight.acquire()
+            self._batch = []
+            flush = loop.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        try:
+            item_columns = ([], [], [], [], [])
+            for order in batch:
+                for line_no, (product_id, quantity, price) in enumerate(order.rows, 1):
+                    for column, value in zip(item_columns, (order.id, product_id, quantity, price, line_no)):
+                        column.append(value)
+            async with self._pool.acquire() as connection:
+                rows = await connection.fetch(
+                    PLACE_ORDERS,
+                    [order.id for order in batch], [order.user_id for order in batch],
+                    [order.total_price for order in batch], [order.payload for order in batch],
+                    *item_columns, self._topic
+                )
+            placed = {row['id'] for row in rows}
+            for order in batch:
+                order.resolve(order.id if order.id in placed else None)
+        except Exception as e:
+            # One bad order must not fail the whole batch, place them one by one
+            print(f"Group commit of {len(batch)} orders failed, placing them one by one: {e}")
+            await self._place_each(batch)
+        finally:
+            self._in_flight.release()
+
+    async def _place_each(self, batch):
+        for order in batch:
+            try:
+                async with self._pool.acquire() as connection:
+                    order.resolve(await place_order(
+                        connection, self._topic, order.user_id, order.total_price, order.products, self._copy_threshold
+                    ))
+            except Exception as e:
+                order.fail(e)
+
+    # Stop collecting, write the orders still queued and wait for the batches in flight
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        batch, self._batch = self._batch, []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._in_flight.acquire()
+            await self._flush(batch)
+        await asyncio.gather(*self._flushes, return_exceptions=True)
@@ -0,0 +1,136 @@
+import asyncio
+# This we are using to get environmental variables from .env file. Install this dependency by running this command : pip install python-decouple
+from decouple import config
+import asyncpg
+from confluent_kafka import KafkaError, KafkaException
+from kafka_producer import AsyncProducer
+from event_codec import DeadLetter, encode
+
+# Outbox relay configuration
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=500, cast=int)
+OUTBOX_IDLE_INTERVAL = config('OUTBOX_IDLE_INTERVAL', default=0.2, cast=float)  # seconds to wait when the outbox is empty
+OUTBOX_ERROR_BACKOFF = config('OUTBOX_ERROR_BACKOFF', default=5.0, cast=float)  # seconds to wait after a failed batch
+# Seconds a claimed row is left to its relay before another relay may publish it. Longer than the producer's
+# message.timeout.ms (300 s by default), so a row is only claimed again when its relay died.
+OUTBOX_CLAIM_TIMEOUT = config('OUTBOX_CLAIM_TIMEOUT', default=330.0, cast=float)
+# A row whose publish failed is tried again after OUTBOX_RETRY_BACKOFF seconds times its attempts, and sent to the
+# DLQ after OUTBOX_MAX_ATTEMPTS attempts (right away when the error is permanent)
+OUTBOX_RETRY_BACKOFF = config('OUTBOX_RETRY_BACKOFF', default=5.0, cast=float)
+OUTBOX_MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=10, cast=int)
+
+# Claim the oldest available rows in one short statement: they are leased until claim timeout instead of being kept
+# locked while the broker acknowledges them. SKIP LOCKED lets several relays claim concurrently without sharing a row.
+CLAIM_ROWS = """
+    UPDATE order_service_db.outbox SET available_at = localtimestamp + $2 * interval '1 second'
+    WHERE id IN (
+        SELECT id FROM order_service_db.outbox WHERE available_at <= localtimestamp
+        ORDER BY id LIMIT $1 FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, topic, event_key, payload, attempts
+"""
+DELETE_ROWS = "DELETE FROM order_service_db.outbox WHERE id = ANY($1::bigint[])"
+# Hand a failed row back for a later attempt
+RETRY_ROW = """
+    UPDATE order_service_db.outbox
+    SET attempts = attempts + 1, last_error = $2, available_at = localtimestamp + $3 * interval '1 second'
+    WHERE id = $1
+"""
+# Errors which publishing the same row again cannot fix
+PERMANENT_ERRORS = {
+    KafkaError.MSG_SIZE_TOO_LARGE, KafkaError.INVALID_MSG, KafkaError.INVALID_RECORD, KafkaError._INVALID_ARG,
+    KafkaError.TOPIC_EXCEPTION, KafkaError.TOPIC_AUTHORIZATION_FAILED,
+}
+
+
+# Whether a failed publish is worth trying again. librdkafka already retried the transient broker errors until
+# message.timeout.ms, a timeout or an unavailable broker may still be over by the next attempt.
+def is_permanent(error):
+    if not isinstance(error, KafkaException):
+        return True
+    kafka_error = error.args[0] if error.args else None
+    return not isinstance(kafka_error, KafkaError) or kafka_error.code() in PERMANENT_ERRORS
+
+
+# Publish a row and wait for the broker. Returns None once delivered, the exception otherwise.
+async def publish(producer, row):
+    try:
+        await (await producer.send(row['topic'], row['payload'], key=row['event_key']))
+    except Exception as e:
+        return e
+    return None
+
+
+# Claim a batch of outbox rows, publish them and delete the delivered ones (at-least-once). A row which fails is
+# tried again later, or sent to the DLQ when the error is permanent or its attempts are used up, so one bad row
+# never holds back the rest of the outbox. Returns the number of rows claimed.
+async def relay_outbox_batch(pool, producer, dlq_topic, batch_size=OUTBOX_BATCH_SIZE):
+    rows = await pool.fetch(CLAIM_ROWS, batch_size, OUTBOX_CLAIM_TIMEOUT)
+    if not rows:
+        return 0
+
+    errors = await asyncio.gather(*(publish(producer, row) for row in rows))
+    done = [row['id'] for row, error in zip(rows, errors) if error is None]
+    for row, error in zip(rows, errors):
+        if error is None:
+            continue
+        attempts = row['attempts'] + 1
+        if is_permanent(error) or attempts >= OUTBOX_MAX_ATTEMPTS:
+            dead_letter = DeadLetter(topic=row['topic'], error=str(error), payload=bytes(row['payload']))
+            if await publish(producer, {'topic': dlq_topic, 'payload': encode(dead_letter), 'event_key': row['event_key']}) is None:
+                print(f"Outbox row {row['id']} sent to the DLQ after {attempts} attempts: {error}")
+                done.append(row['id'])
+                continue
+        print(f"Outbox row {row['id']} failed (attempt {attempts}), retrying later: {error}")
+        await pool.execute(RETRY_ROW, row['id'], str(error), OUTBOX_RETRY_BACKOFF * attempts)
+
+    if done:
+        await pool.execute(DELETE_ROWS, done)
+    return len(rows)
+
+
+# Keep draining the outbox until cancelled. Full batches are followed immediately by the next one.
+async def run_outbox_relay(pool, producer, dlq_topic, batch_size=OUTBOX_BATCH_SIZE, idle_interval=OUTBOX_IDLE_INTERVAL):
+    while True:
+        try:
+            relayed = await relay_outbox_batch(pool, producer, dlq_topic, batch_size)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Outbox relay error: {e}")
+            await asyncio.sleep(OUTBOX_ERROR_BACKOFF)
+            continue
+
+        if relayed < batch_size:
+            await asyncio.sleep(idle_interval)
+
+
+# Standalone relay, run more of these to raise the event throughput: python outbox_relay.py
+async def main():
+    db_config = {
+        'user': config('DB_USER'),
+        'password': config('DB_PASSWORD'),
+        'database': config('DB_NAME'),
+        'host': config('DB_HOST'),
+        'port': config('DB_PORT', default=5433, cast=int),
+    }
+    p_conf = {
+        'bootstrap.servers': config('KAFKA_BOOTSTRAP_SERVERS'),
+        'retries': config('KAFKA_PRODUCER_RETRIES', default=3, cast=int),
+        'retry.backoff.ms': 60000,
+        'enable.idempotence': True
+    }
+    pool = await asyncpg.create_pool(**db_config)
+    producer = AsyncProducer(p_conf)
+    producer.start()
+    try:
+        await run_outbox_relay(pool, producer, config('KAFKA_PRODUCER_TOPIC_DLQ'))
+    finally:
+        await producer.close()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+import asyncio
+import zlib
+from collections import OrderedDict
+
+# Messages buffered per lane before submit() waits for the lane to catch up
+LANE_QUEUE_SIZE = 1000
+
+
+# Offsets of one partition which are in flight, in fetch order. The committable offset only moves past
+# the longest run of finished messages, so nothing is committed before every earlier message is done.
+class PartitionOffsets:
+    def __init__(self):
+        self._in_flight = OrderedDict()  # offset -> finished
+        self.committable = None
+
+    def add(self, offset):
+        self._in_flight[offset] = False
+
+    # Mark the offset as processed, returns how many messages the committable offset moved past
+    def done(self, offset):
+        self._in_flight[offset] = True
+        released = 0
+        while self._in_flight:
+            offset, finished = next(iter(self._in_flight.items()))
+            if not finished:
+                break
+            self._in_flight.popitem(last=False)
+            self.committable = offset + 1
+            released += 1
+        return released
+
+
+# Processes the messages of different partitions concurrently on the asyncio loop.
+# Every partition is split in lanes_per_partition lanes by message key, each lane is a queue handled by its
+# own task in order, so the events of one order_id / user_id (one key) are never reordered. At most
+# `concurrency` handlers run at once, which should match the DB pool size.
+# on_committable(topic, partition, offset, count) is called when a partition's committable offset moves past count messages.
+class PartitionWorkers:
+    def __init__(self, handler, on_committable, concurrency=10, lanes_per_partition=1):
+        self._handler = handler
+        self._on_committable = on_committable
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lanes_per_partition = lanes_per_partition
+        self._lanes = {}    # (topic, partition, lane) -> (queue, task)
+        self._offsets = {}  # (topic, partition) -> PartitionOffsets
+        self._error = None
+
+    def _lane_of(self, msg):
+        key = msg.key()
+        if self._lanes_per_partition == 1 or not key:
+            return 0
+        return zlib.crc32(key) % self._lanes_per_partition
+
+    # Queue the message on its lane. Waits when the lane is full, raises if a handler failed.
+    async def submit(self, msg):
+        self.raise_if_failed()
+        topic_partition = (msg.topic(), msg.partition())
+        self._offsets.setdefault(topic_partition, PartitionOffsets()).add(msg.offset())
+
+        lane = topic_partition + (self._lane_of(msg),)
+        if lane not in self._lanes:
+            queue = asyncio.Queue(maxsize=LANE_QUEUE_SIZE)
+            self._lanes[lane] = (queue, asyncio.get_running_loop().create_task(self._run_lane(queue)))
+        await self._lanes[lane][0].put(msg)
+
+    async def _run_lane(self, queue):
+        while True:
+            msg = await queue.get()
+            try:
+                # After a failure the remaining messages are left unprocessed, their offsets are never committed
+                if self._error is None:
+                    async with self._semaphore:
+                        await self._handler(msg)
+                    self._finished(msg)
+            except Exception as e:
+                self._error = e
+            finally:
+                queue.task_done()
+
+    def _finished(self, msg):
+        topic_partition = (msg.topic(), msg.partition())
+        offsets = self._offsets.get(topic_partition)
+        if offsets is None:
+            return
+        released = offsets.done(msg.offset())
+        if released:
+            self._on_committable(msg.topic(), msg.partition(), offsets.committable, released)
+
+    def raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    # Wait until every queued message of the partitions (all of them by default) is processed, then forget them
+    # when forget is set (e.g. the partitions were revoked)
+    async def drain(self, topic_partitions=None, forget=False):
+        lanes = [lane for lane in self._lanes if topic_partitions is None or lane[:2] in topic_partitions]
+        await asyncio.gather(*(self._lanes[lane][0].join() for lane in lanes))
+        if forget:
+            for lane in lanes:
+                self._lanes.pop(lane)[1].cancel()
+                self._offsets.pop(lane[:2], None)
+
+    # Drop the queued messages of the partitions without processing them and stop their lanes, e.g. the partitions
+    # were lost and another consumer owns them already. The queues are emptied so a submit() waiting for room returns.
+    def discard(self, topic_partitions):
+        for lane in [lane for lane in self._lanes if lane[:2] in topic_partitions]:
+            queue, task = self._lanes.pop(lane)
+            task.cancel()
+            while not queue.empty():
+                queue.get_nowait()
+            self._offsets.pop(lane[:2], None)
+
+    async def close(self):
+        for queue, task in self._lanes.values():
+            task.cancel()
+        await asyncio.gather(*(task for queue, task in self._lanes.values()), return_exceptions=True)
+        self._lanes.clear()
+        self._offsets.clear()
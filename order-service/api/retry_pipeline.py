@@ -0,0 +1,132 @@
+import asyncio
+import time
+# Asyncio adapter around the confluent_kafka Consumer
+from kafka_consumer import AsyncConsumer
+# Coalesced manual offset commits
+from offset_committer import OffsetCommitter
+from event_codec import DeadLetter, encode
+
+# Headers carried by a message on a retry topic
+ATTEMPT_HEADER = 'retry-attempt'
+ORIGINAL_TOPIC_HEADER = 'retry-original-topic'
+DUE_HEADER = 'retry-due'  # epoch milliseconds
+ERROR_HEADER = 'retry-error'
+
+
+# Retry tiers from a 'topic:delay seconds,...' setting, e.g. 'retry-5s:5,retry-1m:60,retry-10m:600'
+def parse_retry_tiers(value):
+    tiers = []
+    for tier in value.split(','):
+        if tier.strip():
+            topic, delay = tier.strip().rsplit(':', 1)
+            tiers.append((topic, float(delay)))
+    return tiers
+
+
+def retry_headers(msg):
+    return {key: value for key, value in (msg.headers() or [])}
+
+
+# Epoch seconds at which a retry message may be processed
+def retry_due(msg):
+    due = retry_headers(msg).get(DUE_HEADER)
+    return int(due) / 1000 if due else 0
+
+
+# A message read back from a retry topic, seen by the handlers as a message of its original topic
+class RetriedMessage:
+    def __init__(self, msg):
+        self._msg = msg
+        self._topic = retry_headers(msg).get(ORIGINAL_TOPIC_HEADER, b'').decode() or msg.topic()
+
+    def topic(self):
+        return self._topic
+
+    def __getattr__(self, name):
+        return getattr(self._msg, name)
+
+
+# Sends a message whose processing failed to the next retry tier, with its original key, value and topic,
+# or to the DLQ once every tier was tried. The returned coroutine completes when the broker has the message,
+# so the failed message's offset can be committed afterwards.
+class RetryRouter:
+    def __init__(self, producer, tiers, dlq_topic):
+        self._producer = producer
+        self._tiers = tiers
+        self._dlq_topic = dlq_topic
+
+    async def route(self, msg, error):
+        headers = retry_headers(msg)
+        attempt = int(headers.get(ATTEMPT_HEADER, 0))
+        if attempt >= len(self._tiers):
+            print(f"Giving up on {msg.topic()} message after {attempt} retries: {error}")
+            dead_letter = DeadLetter(topic=msg.topic(), error=str(error), payload=msg.value())
+            await (await self._producer.send(self._dlq_topic, value=encode(dead_letter), key=msg.key()))
+            return
+
+        topic, delay = self._tiers[attempt]
+        await (await self._producer.send(topic, value=msg.value(), key=msg.key(), headers=[
+            (ATTEMPT_HEADER, str(attempt + 1).encode()),
+            (ORIGINAL_TOPIC_HEADER, msg.topic().encode()),
+            (DUE_HEADER, str(int((time.time() + delay) * 1000)).encode()),
+            (ERROR_HEADER, str(error).encode()),
+        ]))
+
+
+# Consumes the retry topics in its own consumer group, so waiting messages never hold back the main partitions.
+# A retry topic has a single delay, its messages are in due order, so when the head of a partition is not due yet
+# the partition is paused, rewound to that message and resumed when it is due. Due messages go through the handler
+# as messages of their original topic, the handler routes the failures to the next tier.
+class RetryConsumer:
+    def __init__(self, config, topics, handler, commit_every=100, commit_interval=1.0):
+        self._consumer = AsyncConsumer(config, topics, batch_size=100, queue_size=2, on_revoke=self._on_revoke)
+        self._handler = handler
+        self._committer = OffsetCommitter(self._consumer, commit_every=commit_every, commit_interval=commit_interval)
+        self._paused = {}  # (topic, partition) -> resume timer
+        self._processing = asyncio.Lock()
+
+    # Forget the timers of revoked partitions and give back their processed offsets for the consumer to commit
+    async def _on_revoke(self, topic_partitions, lost):
+        async with self._processing:
+            for topic_partition in topic_partitions:
+                timer = self._paused.pop(topic_partition, None)
+                if timer is not None:
+                    timer.cancel()
+        return self._committer.take_pending(topic_partitions)
+
+    def _hold(self, msg, due):
+        topic_partition = (msg.topic(), msg.partition())
+        self._consumer.pause_at(msg)
+        self._paused[topic_partition] = asyncio.get_running_loop().call_later(
+            max(0, due - time.time()), self._release, topic_partition
+        )
+
+    def _release(self, topic_partition):
+        if self._paused.pop(topic_partition, None) is not None:
+            self._consumer.resume(*topic_partition)
+
+    async def run(self, stopping):
+        self._consumer.start()
+        self._committer.start()
+        try:
+            while not stopping.is_set():
+                messages = await self._consumer.getmany(timeout=1.0)
+                async with self._processing:
+                    for msg in messages:
+                        if msg.error() or not self._consumer.owns(msg):
+                            continue
+                        # Messages fetched before the partition was paused are fetched again once it is resumed
+                        if (msg.topic(), msg.partition()) in self._paused:
+                            continue
+                        due = retry_due(msg)
+                        if due > time.time():
+                            self._hold(msg, due)
+                            continue
+                        await self._handler(RetriedMessage(msg))
+                        self._committer.mark(msg.topic(), msg.partition(), msg.offset() + 1)
+        finally:
+            for timer in self._paused.values():
+                timer.cancel()
+            self._paused.clear()
+            await self._committer.close()
+            await self._consumer.close()
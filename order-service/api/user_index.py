@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+# Asyncio adapter around the confluent_kafka Consumer
+from kafka_consumer import AsyncConsumer
+from event_codec import DecodeError, UserRegistered, decode
+
+USER_EXISTS = "SELECT EXISTS (SELECT 1 FROM order_service_db.registered_users WHERE user_id = $1)"
+ALL_USERS = "SELECT user_id FROM order_service_db.registered_users WHERE user_id IS NOT NULL"
+
+
+# In-process set of the registered user ids, so validating the user of an order costs no DB round trip.
+# It is warmed from registered_users at startup and kept current from the user-registration topic. Users
+# registered after the warm-up whose event has not arrived yet are looked up in the DB (and then remembered).
+# Ids are kept as 128 bit integers, which take less memory than the UUID strings.
+class RegisteredUserIndex:
+    def __init__(self, pool):
+        self._pool = pool
+        self._users = set()
+        self._consumer = None
+        self._task = None
+        self.db_lookups = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def add(self, user_id):
+        self._users.add(uuid.UUID(str(user_id)).int)
+
+    # Follow the topic, then load the table. The partitions are assigned asynchronously, so registrations made
+    # around the warm-up may be in neither; exists() finds those in the DB, which is what keeps the index correct.
+    async def start(self, consumer_config, topic, prefetch=10000):
+        # Every process reads the whole topic from now on: its own throwaway group, nothing committed
+        self._consumer = AsyncConsumer(dict(consumer_config, **{
+            'group.id': f"order-service-user-index-{uuid.uuid4()}",
+            'auto.offset.reset': 'latest',
+            'enable.auto.commit': False,
+        }), [topic])
+        self._consumer.start()
+        self._task = asyncio.get_running_loop().create_task(self._follow())
+
+        async with self._pool.acquire() as connection:
+            # A server side cursor streams the table instead of loading every row in one result
+            async with connection.transaction():
+                async for record in connection.cursor(ALL_USERS, prefetch=prefetch):
+                    self._users.add(record['user_id'].int)
+        print(f"Registered user index warmed with {len(self._users)} users")
+
+    async def _follow(self):
+        while True:
+            for msg in await self._consumer.getmany():
+                if msg.error():
+                    continue
+                try:
+                    self.add(decode(UserRegistered, msg.value()).user_id)
+                except Exception as e:
+                    # Such a user is found by the DB lookup of exists(), keep following
+                    if not isinstance(e, (DecodeError, ValueError)):
+                        print(f"Registered user index could not read a {msg.topic()} event: {e}")
+
+    # Whether the user is registered, from memory when possible
+    async def exists(self, user_id):
+        try:
+            user = uuid.UUID(str(user_id))
+        except ValueError:
+            return False
+        if user.int in self._users:
+            return True
+        self.db_lookups += 1
+        found = await self._pool.fetchval(USER_EXISTS, user)
+        if found:
+            self._users.add(user.int)
+        return found
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._consumer is not None:
+            await self._consumer.close()
+            self._consumer = None
@@ -0,0 +1,98 @@
+import asyncio
+import time
+import uuid
+# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
+from confluent_kafka import Consumer, TopicPartition
+from event_codec import DecodeError, SchemaUnavailable, UserRegistered, decode
+
+# Replayed user ids are COPYed into a session temp table, then merged into registered_users with one statement
+STAGING_TABLE = 'registered_users_replay'
+CREATE_STAGING = f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (user_id UUID)"
+MERGE_STAGING = f"""
+    INSERT INTO order_service_db.registered_users(user_id)
+    SELECT DISTINCT user_id FROM {STAGING_TABLE}
+    ON CONFLICT (user_id) DO NOTHING
+"""
+TRUNCATE_STAGING = f"TRUNCATE {STAGING_TABLE}"
+
+
+# (start, end) offsets of every partition of the topic. The replay starts at from_offset (clamped to the oldest
+# offset still in the log), at the first message at or after from_timestamp (epoch ms), or at the beginning,
+# and ends at the high watermark taken now.
+def replay_ranges(consumer, topic, from_offset=None, from_timestamp=None):
+    partitions = sorted(consumer.list_topics(topic, timeout=10).topics[topic].partitions)
+    ranges = {}
+    for partition in partitions:
+        ranges[partition] = consumer.get_watermark_offsets(TopicPartition(topic, partition), timeout=10)
+    if from_timestamp is not None:
+        found = consumer.offsets_for_times([TopicPartition(topic, p, from_timestamp) for p in partitions], timeout=10)
+        # -1 means no message at or after the timestamp
+        return {tp.partition: (tp.offset if tp.offset >= 0 else ranges[tp.partition][1], ranges[tp.partition][1]) for tp in found}
+    return {partition: (max(low, from_offset or 0), high) for partition, (low, high) in ranges.items()}
+
+
+# Bulk-load the user ids of the topic into registered_users and commit the end offsets for the consumer group of
+# consumer_conf, so the normal consumer picks up right after the replayed events. The group must have no active
+# member while it runs. Events which cannot be decoded (or whose schema the registry cannot serve for now) are
+# counted and skipped. Returns (loaded, skipped).
+async def replay_user_registrations(pool, consumer_conf, topic, from_offset=None, from_timestamp=None,
+                                    chunk_size=10000, merge_every=500000, progress_interval=5.0):
+    loop = asyncio.get_running_loop()
+    consumer = Consumer(dict(consumer_conf, **{'enable.auto.commit': False, 'enable.partition.eof': False}))
+    try:
+        ranges = await loop.run_in_executor(None, replay_ranges, consumer, topic, from_offset, from_timestamp)
+        ends = {partition: end for partition, (start, end) in ranges.items() if start < end}
+        total = sum(end - start for start, end in ranges.values() if start < end)
+        print(f"Replaying {total} {topic} events from {len(ends)} partitions")
+
+        # Every partition is fetched in parallel by librdkafka, the next chunk is fetched while the current one is COPYed
+        consumer.assign([TopicPartition(topic, partition, ranges[partition][0]) for partition in ends])
+        loaded = skipped = staged = 0
+        started = last_report = time.monotonic()
+        async with pool.acquire() as connection:
+            await connection.execute(CREATE_STAGING)
+            await connection.execute(TRUNCATE_STAGING)
+            fetch = loop.run_in_executor(None, consumer.consume, chunk_size, 1.0) if ends else None
+            while fetch is not None:
+                records = []
+                for msg in await fetch:
+                    if msg.error() or msg.partition() not in ends or msg.offset() >= ends[msg.partition()]:
+                        continue
+                    try:
+                        records.append((uuid.UUID(decode(UserRegistered, msg.value()).user_id),))
+                    except (DecodeError, SchemaUnavailable, ValueError):
+                        skipped += 1
+                    # Stop fetching the partitions which reached their end offset
+                    if msg.offset() + 1 >= ends[msg.partition()]:
+                        consumer.pause([TopicPartition(topic, msg.partition())])
+                        del ends[msg.partition()]
+
+                # Offsets can have gaps (e.g. compacted or transaction markers), so an idle fetch also checks the positions
+                if ends and not records:
+                    for tp in consumer.position([TopicPartition(topic, partition) for partition in ends]):
+                        if tp.offset >= ends[tp.partition]:
+                            consumer.pause([TopicPartition(topic, tp.partition)])
+                            del ends[tp.partition]
+
+                fetch = loop.run_in_executor(None, consumer.consume, chunk_size, 1.0) if ends else None
+                if records:
+                    await connection.copy_records_to_table(STAGING_TABLE, records=records, columns=['user_id'])
+                    loaded += len(records)
+                    staged += len(records)
+                if staged >= merge_every or (fetch is None and staged):
+                    await connection.execute(MERGE_STAGING)
+                    await connection.execute(TRUNCATE_STAGING)
+                    staged = 0
+
+                now = time.monotonic()
+                if now - last_report >= progress_interval or fetch is None:
+                    last_report = now
+                    rate = (loaded + skipped) / max(now - started, 0.001)
+                    print(f"Replayed {loaded + skipped}/{total} events ({skipped} skipped), {rate:.0f} events/sec")
+
+        # Hand off: the normal consumer of the group starts at the end offsets of the replay
+        offsets = [TopicPartition(topic, partition, end) for partition, (start, end) in ranges.items()]
+        await loop.run_in_executor(None, lambda: consumer.commit(offsets=offsets, asynchronous=False))
+        return loaded, skipped
+    finally:
+        await loop.run_in_executor(None, consumer.close)
@@ -51,12 +51,41 @@ CREATE TABLE IF NOT EXISTS order_items (
     order_id UUID REFERENCES orders(id),
     product_id UUID DEFAULT NULL,
     quantity INTEGER,
-    price DECIMAL
+    price DECIMAL,
+    -- Position of the item in the cart, from 1, the items of an order are listed in this order
+    line_no INTEGER
 );
+-- For a database created before line_no existed (its older items have none):
+-- ALTER TABLE order_service_db.order_items ADD COLUMN IF NOT EXISTS line_no INTEGER;
+-- The line items of an order are read together (GET /orders/<id>?include=items)
+CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items(order_id);
 -- Create the registered_users table
 CREATE TABLE IF NOT EXISTS order_service_db.registered_users
 (
     id uuid NOT NULL DEFAULT order_service_db.uuid_generate_v4(),
     user_id uuid,        
-    CONSTRAINT registered_users_pkey PRIMARY KEY (id)
-);
\ No newline at end of file
+    CONSTRAINT registered_users_pkey PRIMARY KEY (id),
+    -- One row per user, a redelivered user-registration event is skipped with ON CONFLICT DO NOTHING
+    CONSTRAINT registered_users_user_id_key UNIQUE (user_id)
+);
+-- For a database created before the constraint existed, remove the duplicates and add it:
+-- DELETE FROM order_service_db.registered_users a USING order_service_db.registered_users b
+--     WHERE a.user_id = b.user_id AND a.ctid > b.ctid;
+-- ALTER TABLE order_service_db.registered_users ADD CONSTRAINT registered_users_user_id_key UNIQUE (user_id);
+-- Create the outbox table. Events are written in the same transaction as the order
+-- and published to Kafka by the relay in api/outbox_relay.py
+CREATE TABLE IF NOT EXISTS order_service_db.outbox
+(
+    id BIGSERIAL PRIMARY KEY,
+    topic VARCHAR(255) NOT NULL,
+    event_key TEXT,
+    payload BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT current_timestamp,
+    -- A relay claims a row by moving available_at past its claim timeout, a failed row is pushed back the same way
+    available_at TIMESTAMP NOT NULL DEFAULT current_timestamp,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+-- For a database created before the relay claimed rows:
+-- ALTER TABLE order_service_db.outbox ADD COLUMN IF NOT EXISTS available_at TIMESTAMP NOT NULL DEFAULT current_timestamp,
+--     ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0, ADD COLUMN IF NOT EXISTS last_error TEXT;
@@ -4,8 +4,12 @@ from sanic.response import json
 from decouple import config 
 # This library we are using to connect API with database postgresql. Install this dependency by running this command : pip install asyncpg
 import asyncpg
-# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
-from confluent_kafka import Producer
+# Asyncio wrapper around the confluent_kafka Producer. Install this dependency by running this command : pip install confluent_kafka
+from kafka_producer import AsyncProducer
+# Typed encoding and decoding of the Kafka events. Install this dependency by running this command : pip install msgspec
+from event_codec import DeadLetter, PaymentFailed, PaymentSucceeded, configure as configure_codec, encode
+# Client for the Confluent schema registry used by the avro wire format
+from schema_registry import open_registry
 # Import the authenticate and authenticate_middleware functions
 from authentication import authenticate, authenticate_middleware
 
@@ -20,6 +24,9 @@ KAFKA_BOOTSTRAP_SERVERS = config('KAFKA_BOOTSTRAP_SERVERS')
 KAFKA_PRODUCER_TOPIC = config('KAFKA_PRODUCER_TOPIC')
 KAFKA_PRODUCER_TOPIC2 = config('KAFKA_PRODUCER_TOPIC2')
 KAFKA_PRODUCER_TOPIC_DLQ = config('KAFKA_PRODUCER_TOPIC_DLQ')
+# Event Configuration, EVENT_WIRE_FORMAT is 'json' or 'avro' (schema registry framing)
+EVENT_WIRE_FORMAT = config('EVENT_WIRE_FORMAT', default='json')
+SCHEMA_REGISTRY_URL = config('SCHEMA_REGISTRY_URL', default='')
 
 # API Configuration
 API_HOST = config('API_HOST')
@@ -43,19 +50,23 @@ p_conf = {
     'retry.backoff.ms': 60000,  # Wait for 60,000ms (1 minute) before retrying
     'enable.idempotence': True
 }
-p = Producer(p_conf)
+p = AsyncProducer(p_conf)
 
 # Register the middleware
 @app.middleware('request')(authenticate_middleware)
 
-# Register the setup_db function to be executed before starting the server
+# Register the event codec, the setup_db function and the producer poll task to be executed before starting the server
 @app.listener('before_server_start')
 async def before_server_start(app, loop):
+    # Schemas are registered here once, producing an event never calls the schema registry
+    configure_codec(EVENT_WIRE_FORMAT, open_registry(SCHEMA_REGISTRY_URL))
     await setup_db(app)
+    p.start()
 
-# Register the close_db function to be executed after stopping the server
+# Register the close_db function to be executed after stopping the server, outstanding messages are flushed first
 @app.listener('after_server_stop')
 async def after_server_stop(app, loop):
+    await p.close()
     await close_db(app)
 
 ############## All the functions code starts from here ###########
@@ -85,13 +96,8 @@ async def create_payment(order_id, amount, status, payment_gateway_response):
 # This function is a callback function from kafka producer method used to identify the errors and report to DLQ for further investigation
 def delivery_callback(err, msg):
     if err:
-        data = msg.value().decode('utf-8')
-        data = data.replace("'", "\"")
-        data = json.loads(data) 
-        data['topic'] = msg.topic()
-        data['error'] = str(err)
-        print(data)    
-        p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=str(data) )
+        dead_letter = DeadLetter(topic=msg.topic(), error=str(err), payload=msg.value())
+        p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=encode(dead_letter), key=msg.key() )
         print(f"Failed to deliver message: {err}. Message might be retried.")
     else:                
         print(f"Message delivered to {msg.topic()} [{msg.partition()}]")
@@ -119,18 +125,14 @@ async def initiate_payment(request):
 
             payment_id = await create_payment(order_id, amount, status, payment_gateway_response) 
             if payment_id and status == 'success':
-                # Sending message to topic payment-success
-                payment_data_for_producer = {"payment_id":str(payment_id), "order_id": str(order_id), "amount": amount, "payment_gateway_response": payment_gateway_response}
-                p.produce( KAFKA_PRODUCER_TOPIC, value=str(payment_data_for_producer), callback=delivery_callback ) 
-                p.flush()
-                p.poll(0.5) 
+                # Sending message to topic payment-success, keyed by order id like payment-failure so both events of an order keep their order
+                payment_event = PaymentSucceeded(payment_id=str(payment_id), order_id=str(order_id), amount=amount, payment_gateway_response=payment_gateway_response)
+                await p.send( KAFKA_PRODUCER_TOPIC, value=encode(payment_event), key=payment_event.order_id, callback=delivery_callback )
                 return json({"message": "Payment made successfully","id": str(payment_id)}, status=201) 
             else:
-                 # Sending message to topic payment-failure
-                payment_data_for_producer = {"payment_id":str(payment_id), "order_id": str(order_id), "amount": amount, "payment_gateway_response": payment_gateway_response}
-                p.produce( KAFKA_PRODUCER_TOPIC2, value=str(payment_data_for_producer), callback=delivery_callback)
-                p.flush()
-                p.poll(0.5) 
+                 # Sending message to topic payment-failure, keyed by order id
+                payment_event = PaymentFailed(payment_id=str(payment_id), order_id=str(order_id), amount=amount, payment_gateway_response=payment_gateway_response)
+                await p.send( KAFKA_PRODUCER_TOPIC2, value=encode(payment_event), key=payment_event.order_id, callback=delivery_callback)
                 return json({"message": "Payment failed","id": str(payment_id)}, status=201)
             
     except Exception as e:     
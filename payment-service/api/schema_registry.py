@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+
+class SchemaRegistryError(Exception):
+    pass
+
+# The registry could not be reached or failed on its side (connection error, timeout, 5xx), the call may succeed later
+class SchemaRegistryUnavailable(SchemaRegistryError):
+    pass
+
+
+# Client for the Confluent schema registry REST API (kafka/docker-compose.yml runs one on http://localhost:8081).
+# Registered ids and fetched schemas are cached, so every schema costs one HTTP call per process and the
+# encode/decode hot path never goes to the network once it has seen a schema.
+class SchemaRegistryClient:
+    def __init__(self, url, timeout=5):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._ids_by_subject = {}
+        self._schemas_by_id = {}
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(
+            self.url + path, data=data, method=method,
+            headers={'Content-Type': 'application/vnd.schemaregistry.v1+json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code >= 500 or e.code == 429:
+                raise SchemaRegistryUnavailable(f"{method} {self.url}{path} failed: {e}") from e
+            raise SchemaRegistryError(f"{method} {self.url}{path} failed: {e}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise SchemaRegistryUnavailable(f"{method} {self.url}{path} failed: {e}") from e
+        except ValueError as e:
+            raise SchemaRegistryError(f"{method} {self.url}{path} failed: {e}") from e
+
+    # Register the schema under the subject (a no-op on the registry side if it already exists) and return its id
+    def register(self, subject, schema):
+        if subject not in self._ids_by_subject:
+            response = self._request('POST', f'/subjects/{subject}/versions', {'schema': json.dumps(schema)})
+            self._ids_by_subject[subject] = response['id']
+            self._schemas_by_id[response['id']] = schema
+        return self._ids_by_subject[subject]
+
+    # Return the schema registered with the id
+    def get_schema(self, schema_id):
+        if schema_id not in self._schemas_by_id:
+            response = self._request('GET', f'/schemas/ids/{schema_id}')
+            self._schemas_by_id[schema_id] = json.loads(response['schema'])
+        return self._schemas_by_id[schema_id]
+
+
+# Stand-in for the schema registry backed by a JSON file, for tests and local runs without the registry container.
+# Every process pointing at the same file sees the same ids.
+class FileSchemaRegistry:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {'subjects': {}, 'schemas': {}}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def register(self, subject, schema):
+        with self._lock:
+            registry = self._load()
+            if subject in registry['subjects']:
+                return registry['subjects'][subject]
+            schema_id = len(registry['schemas']) + 1
+            registry['subjects'][subject] = schema_id
+            registry['schemas'][str(schema_id)] = schema
+            with open(self.path, 'w') as f:
+                json.dump(registry, f, indent=2)
+            return schema_id
+
+    def get_schema(self, schema_id):
+        schema = self._load()['schemas'].get(str(schema_id))
+        if schema is None:
+            raise SchemaRegistryError(f"Schema {schema_id} not found in {self.path}")
+        return schema
+
+
+# Open a registry from SCHEMA_REGISTRY_URL, file:// urls use the file backed stand-in. No HTTP call is made here.
+def open_registry(url):
+    if not url:
+        return None
+    if url.startswith('file://'):
+        return FileSchemaRegistry(url[len('file://'):])
+    return SchemaRegistryClient(url)
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+# Every product as one JSON line built by Postgres, in (updated_at, id) order through products_updated_at_id_idx.
+# updated_since is inclusive, so resuming from the last updated_at received never misses a product (the products
+# updated at exactly that time are sent again).
+EXPORT_QUERY = """
+    SELECT json_build_object(
+        'id', id, 'name', name, 'description', description, 'price', price,
+        'created_at', created_at, 'updated_at', updated_at
+    )::text
+    FROM product_service_db.products
+    {where}
+    ORDER BY updated_at, id
+"""
+EXPORT_ALL = EXPORT_QUERY.format(where="")
+EXPORT_SINCE = EXPORT_QUERY.format(where="WHERE updated_at >= $1")
+
+
+# Watermark of the updated_since parameter, None when absent. Raises ValueError when it is not an ISO timestamp.
+# updated_at is a timestamp without time zone holding UTC (the DB default time zone), so a value with an offset
+# (e.g. a trailing Z) is converted to naive UTC, asyncpg cannot bind an aware datetime to it.
+def parse_watermark(value):
+    if not value:
+        return None
+    watermark = datetime.fromisoformat(value)
+    if watermark.tzinfo is not None:
+        watermark = watermark.astimezone(timezone.utc).replace(tzinfo=None)
+    return watermark
+
+
+# Stream the products as NDJSON into the streaming response, chunk_rows lines per write. The rows come from a
+# server side cursor, so memory stays the same whatever the catalog size. Returns the number of products sent.
+async def stream_products(pool, response, updated_since=None, chunk_rows=500):
+    sent = 0
+    async with pool.acquire() as connection:
+        # Cursors only live inside a transaction
+        async with connection.transaction(readonly=True):
+            lines = []
+            if updated_since is None:
+                cursor = connection.cursor(EXPORT_ALL, prefetch=chunk_rows)
+            else:
+                cursor = connection.cursor(EXPORT_SINCE, updated_since, prefetch=chunk_rows)
+            async for record in cursor:
+                lines.append(record[0])
+                if len(lines) >= chunk_rows:
+                    await response.send('\n'.join(lines) + '\n')
+                    sent += len(lines)
+                    lines = []
+            if lines:
+                await response.send('\n'.join(lines) + '\n')
+                sent += len(lines)
+    return sent
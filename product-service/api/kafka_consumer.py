@@ -0,0 +1,61 @@
+import asyncio
+import concurrent.futures
+import threading
+# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
+from confluent_kafka import Consumer
+
+# How often the fetch thread checks for close() while it waits for room in the queue (seconds)
+STOP_CHECK_INTERVAL = 0.5
+
+
+# Asyncio adapter around the confluent_kafka Consumer, used to follow the product topic (product_cache.py).
+# consume() blocks, so it runs in a dedicated thread which hands every fetched chunk of messages to the
+# event loop through a bounded asyncio.Queue. When the loop falls behind the queue fills up and the thread
+# stops fetching until there is room again.
+class AsyncConsumer:
+    def __init__(self, config, topics, batch_size=100, poll_timeout=1.0, queue_size=10):
+        self._consumer = Consumer(config)
+        self._topics = topics
+        self._batch_size = batch_size
+        self._poll_timeout = poll_timeout
+        self._queue_size = queue_size
+        self._queue = None
+        self._loop = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    # Subscribe and start the fetch thread. Must be called from the running loop.
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._consumer.subscribe(self._topics)
+        self._thread = threading.Thread(target=self._fetch, name='kafka-consumer-fetch', daemon=True)
+        self._thread.start()
+
+    def _fetch(self):
+        while not self._stopping.is_set():
+            messages = self._consumer.consume(num_messages=self._batch_size, timeout=self._poll_timeout)
+            if not messages:
+                continue
+            put = asyncio.run_coroutine_threadsafe(self._queue.put(messages), self._loop)
+            # Wait for room in the queue (backpressure), but give up when the consumer is closed
+            while not self._stopping.is_set():
+                try:
+                    put.result(timeout=STOP_CHECK_INTERVAL)
+                    break
+                except concurrent.futures.TimeoutError:
+                    continue
+            else:
+                put.cancel()
+
+    # Wait for the next chunk of messages (up to batch_size, in partition order). Messages may carry an error().
+    async def getmany(self):
+        return await self._queue.get()
+
+    # Stop the fetch thread, then close the consumer (which leaves the group) outside the loop
+    async def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            await self._loop.run_in_executor(None, self._thread.join)
+            self._thread = None
+        await self._loop.run_in_executor(None, self._consumer.close)
@@ -0,0 +1,49 @@
+import base64
+import binascii
+import json
+import uuid
+from datetime import datetime
+
+# Keyset pagination of the product list in (created_at, id) order. A page starts right after the last row of the
+# previous one, found through the products_created_at_id_idx index, so every page costs the same whatever its depth.
+LIST_COLUMNS = "id, name, description, price, created_at, updated_at"
+FIRST_PAGE = f"""
+    SELECT {LIST_COLUMNS} FROM product_service_db.products
+    ORDER BY created_at, id
+    LIMIT $1
+"""
+NEXT_PAGE = f"""
+    SELECT {LIST_COLUMNS} FROM product_service_db.products
+    WHERE (created_at, id) > ($1, $2)
+    ORDER BY created_at, id
+    LIMIT $3
+"""
+
+
+# Opaque cursor pointing after the given row
+def encode_cursor(record):
+    position = [record['created_at'].isoformat(), str(record['id'])]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+# (created_at, id) of a cursor, raises ValueError when it was not made by encode_cursor
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, product_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), uuid.UUID(product_id)
+    except (binascii.Error, TypeError, UnicodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+# One page of products after the cursor (the first page without one) and the cursor of the next page, None on the last page
+async def fetch_page(connection, limit, cursor=None):
+    # One extra row tells whether there is a next page
+    if cursor:
+        created_at, product_id = decode_cursor(cursor)
+        records = await connection.fetch(NEXT_PAGE, created_at, product_id, limit + 1)
+    else:
+        records = await connection.fetch(FIRST_PAGE, limit + 1)
+    if len(records) > limit:
+        return records[:limit], encode_cursor(records[limit - 1])
+    return records, None
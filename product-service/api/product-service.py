@@ -1,11 +1,25 @@
+import uuid
+from json import dumps as json_dumps
 from sanic import Sanic
-from sanic.response import json
+from sanic.response import json, raw
 # This library we are using to get environmental variables from .env file. Install this dependency by running this command : pip install python-decouple
 from decouple import config 
 # This library we are using to connect API with database postgresql. Install this dependency by running this command : pip install asyncpg
 import asyncpg
-# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
-from confluent_kafka import Producer
+# Asyncio wrapper around the confluent_kafka Producer. Install this dependency by running this command : pip install confluent_kafka
+from kafka_producer import AsyncProducer
+# Typed encoding and decoding of the Kafka events. Install this dependency by running this command : pip install msgspec
+from event_codec import DeadLetter, ProductChanged, configure as configure_codec, encode
+# Client for the Confluent schema registry used by the avro wire format
+from schema_registry import open_registry
+# Keyset pagination of the product list
+from pagination import fetch_page
+# Streaming NDJSON export of the catalog
+from catalog_export import parse_watermark, stream_products
+# Read-through cache of the encoded products
+from product_cache import ProductCache
+# Bulk import of products through COPY
+from product_import import import_products, read_rows
 # Import the authenticate and authenticate_middleware functions
 from authentication import authenticate, authenticate_middleware
 
@@ -19,6 +33,22 @@ DB_NAME = config('DB_NAME')
 KAFKA_BOOTSTRAP_SERVERS = config('KAFKA_BOOTSTRAP_SERVERS')
 KAFKA_PRODUCER_TOPIC = config('KAFKA_PRODUCER_TOPIC')
 KAFKA_PRODUCER_TOPIC_DLQ = config('KAFKA_PRODUCER_TOPIC_DLQ')
+# Event Configuration, EVENT_WIRE_FORMAT is 'json' or 'avro' (schema registry framing)
+EVENT_WIRE_FORMAT = config('EVENT_WIRE_FORMAT', default='json')
+SCHEMA_REGISTRY_URL = config('SCHEMA_REGISTRY_URL', default='')
+# Product List Configuration, page size when none is given and largest page size allowed
+PRODUCT_LIST_DEFAULT_LIMIT = config('PRODUCT_LIST_DEFAULT_LIMIT', default=5, cast=int)
+PRODUCT_LIST_MAX_LIMIT = config('PRODUCT_LIST_MAX_LIMIT', default=100, cast=int)
+# Export Configuration, products fetched from the cursor and written to the response at a time
+PRODUCT_EXPORT_CHUNK_ROWS = config('PRODUCT_EXPORT_CHUNK_ROWS', default=500, cast=int)
+# Product Cache Configuration, products cached per process and seconds they stay cached. 0 disables the cache.
+PRODUCT_CACHE_SIZE = config('PRODUCT_CACHE_SIZE', default=10000, cast=int)
+PRODUCT_CACHE_TTL = config('PRODUCT_CACHE_TTL', default=60.0, cast=float)
+# Bulk Import Configuration, rows per COPY into the staging table and row errors listed in the response
+PRODUCT_IMPORT_BATCH_SIZE = config('PRODUCT_IMPORT_BATCH_SIZE', default=5000, cast=int)
+PRODUCT_IMPORT_MAX_ERRORS = config('PRODUCT_IMPORT_MAX_ERRORS', default=1000, cast=int)
+# Lookup Configuration, most product ids accepted by one multi-get request
+PRODUCT_LOOKUP_MAX_IDS = config('PRODUCT_LOOKUP_MAX_IDS', default=1000, cast=int)
 
 # API Configuration
 API_HOST = config('API_HOST')
@@ -43,19 +73,28 @@ p_conf = {
     'retry.backoff.ms': 60000,  # Wait for 60,000ms (1 minute) before retrying
     'enable.idempotence': True
 }
-p = Producer(p_conf)
+p = AsyncProducer(p_conf)
 
 # Register the middleware
 @app.middleware('request')(authenticate_middleware)
 
-# Register the setup_db function to be executed before starting the server
+# Register the event codec, the setup_db function, the producer poll task and the product cache to be executed before starting the server
 @app.listener('before_server_start')
 async def before_server_start(app, loop):
+    # Schemas are registered here once, producing an event never calls the schema registry
+    configure_codec(EVENT_WIRE_FORMAT, open_registry(SCHEMA_REGISTRY_URL))
     await setup_db(app)
+    p.start()
+    # The cached products are invalidated by the product events of every worker and replica, including this one's
+    app.ctx.product_cache = ProductCache(app.ctx.db, maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL)
+    if PRODUCT_CACHE_SIZE > 0:
+        app.ctx.product_cache.start({'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS}, KAFKA_PRODUCER_TOPIC)
 
-# Register the close_db function to be executed after stopping the server
+# Register the close_db function to be executed after stopping the server, outstanding messages are flushed first
 @app.listener('after_server_stop')
 async def after_server_stop(app, loop):
+    await app.ctx.product_cache.close()
+    await p.close()
     await close_db(app)
 
 ############## All the functions code starts from here ###########
@@ -68,16 +107,32 @@ async def setup_db(app):
 async def close_db(app):
     await app.ctx.db.close()
 
+# Response of a multi-get: the products in the order of the requested ids (cached ones without a DB round trip, the
+# others with one query), and the ids which were not found or are not valid ids. The encoded products are spliced in as is.
+async def lookup_products(product_ids):
+    if len(product_ids) > PRODUCT_LOOKUP_MAX_IDS:
+        return json({"message": f"At most {PRODUCT_LOOKUP_MAX_IDS} product ids can be requested at once"}, status=201)
+    canonical_ids = []
+    for product_id in product_ids:
+        try:
+            canonical_ids.append(str(uuid.UUID(str(product_id))))
+        except ValueError:
+            canonical_ids.append(None)
+    found = await app.ctx.product_cache.get_many([product_id for product_id in canonical_ids if product_id])
+    products = [found[product_id] for product_id in canonical_ids if product_id in found]
+    missing = [str(requested) for requested, product_id in zip(product_ids, canonical_ids) if product_id not in found]
+    body = b''.join([
+        b'{"message":"', b'Products found' if products else b'No products', b'","data":[', b','.join(products),
+        b'],"missing":', json_dumps(missing).encode('utf-8'), b'}',
+    ])
+    return raw(body, status=201, content_type='application/json')
+
 # This function is a callback function from kafka producer method used to identify the errors and report to DLQ for further investigation
 def delivery_callback(err, msg):
     try:
         if err:
-            data = msg.value().decode('utf-8')
-            data = data.replace("'", "\"")
-            data = json.loads(data) 
-            data['topic'] = msg.topic()
-            data['error'] = str(err)            
-            p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=str(data) )
+            dead_letter = DeadLetter(topic=msg.topic(), error=str(err), payload=msg.value())
+            p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=encode(dead_letter), key=msg.key() )
             print(f"Failed to deliver message: {err}. Message might be retried.")
         else:                
             print(f"Message delivered to {msg.topic()} [{msg.partition()}]")
@@ -100,11 +155,12 @@ async def create_product(request):
                     product_data["name"], product_data["description"], product_data["price"]
                 )  
 
-                # Sending message to topic
-                product_data_for_producer = {"product_id": str(product_id), "name": product_data["name"], "price": product_data["price"]}
-                p.produce( KAFKA_PRODUCER_TOPIC, value=str(product_data_for_producer), callback=delivery_callback )     
-                p.flush()
-                p.poll(0.5)
+                # This worker drops the product right away, the others when the event below reaches them
+                app.ctx.product_cache.invalidate(product_id)
+
+                # Sending message to topic, keyed by product id so all events of a product land on the same partition
+                product_event = ProductChanged(product_id=str(product_id), name=product_data["name"], price=float(product_data["price"]))
+                await p.send( KAFKA_PRODUCER_TOPIC, value=encode(product_event), key=product_event.product_id, callback=delivery_callback )
 
             return json({"message": "Product created successfully","id": str(product_id)}, status=201)
     except Exception as e:     
@@ -112,6 +168,66 @@ async def create_product(request):
         return json({"message": "Error"}, status=201)
 
 
+# Service API to create or update many products at once: a JSON array, or a streamed CSV (Content-Type: text/csv,
+# name,description,price header) or NDJSON (Content-Type: application/x-ndjson) body. Products are matched by name.
+# Valid rows are loaded even when others fail, the failed ones are listed with their row number.
+@app.post("/products/bulk", stream=True)
+async def bulk_import_products(request):
+    try:
+        # The whole body is read before a connection is taken from the pool
+        received, rows, errors = await read_rows(request.headers.get('content-type'), request.stream)
+        changed = []
+        if rows:
+            async with app.ctx.db.acquire() as connection:
+                changed = await import_products(connection, rows, PRODUCT_IMPORT_BATCH_SIZE)
+
+        # One event per new or changed product. They are queued without waiting for each delivery,
+        # librdkafka batches them, failures go to the DLQ through the delivery callback.
+        for record in changed:
+            app.ctx.product_cache.invalidate(record['id'])
+            product_event = ProductChanged(product_id=str(record['id']), name=record['name'], price=float(record['price']))
+            await p.send( KAFKA_PRODUCER_TOPIC, value=encode(product_event), key=product_event.product_id, callback=delivery_callback )
+
+        inserted = sum(1 for record in changed if record['inserted'])
+        data = {
+            "received": received,
+            "inserted": inserted,
+            "updated": len(changed) - inserted,
+            "failed": len(errors),
+            "errors": errors[:PRODUCT_IMPORT_MAX_ERRORS],
+        }
+        return json({"message": "Products imported","data": data}, status=201)
+    except Exception as e:     
+        print(str(e))  
+        return json({"message": "Error"+str(e)}, status=201)
+
+
+# Service API to get many products at once: /products?ids=<id>,<id>,...
+@app.get("/products")
+async def get_products(request):
+    try:
+        product_ids = [product_id.strip() for product_id in request.args.get('ids', '').split(',') if product_id.strip()]
+        if not product_ids:
+            return json({"message": "Enter product ids"}, status=201)
+        return await lookup_products(product_ids)
+    except Exception as e:     
+        print(str(e))  
+        return json({"message": "No products"}, status=201)
+
+
+# Service API to get many products at once, for lists too long for a query string: {"ids": [<id>, <id>, ...]}
+@app.post("/products/lookup")
+async def lookup_products_by_ids(request):
+    try:
+        product_ids = (request.json or {}).get('ids')
+        if not product_ids or not isinstance(product_ids, list):
+            return json({"message": "Enter product ids"}, status=201)
+        return await lookup_products(product_ids)
+    except Exception as e:     
+        print(str(e))  
+        return json({"message": "No products"}, status=201)
+
+
 # Service API to get the single product information
 @app.get("/products/<product_id>")
 async def get_product(request, product_id):
@@ -120,21 +236,12 @@ async def get_product(request, product_id):
         if not product_id:
             return  json({"message": "Enter product id"}, status=201)  
         elif 32 <= len(product_id) <= 36:        
-            async with app.ctx.db.acquire() as connection: 
-                # Begin a transaction to ensure that database operations are atomic. 
-                async with connection.transaction():      
-                    query = "SELECT * FROM product_service_db.products WHERE id = $1"
-                    product_info = await connection.fetch(query, product_id)                                
-                    if not product_info: 
-                        return  json({"message": "Product not found"}, status=201)    
-                    else:                                   
-                        data = {
-                            'id': str(product_info[0]['id']),
-                            'name': product_info[0]['name'],
-                            'description': product_info[0]['description'], 
-                            'price': product_info[0]['price'],                   
-                        }                    
-                        return  json({"message": "Product found","data": data}, status=201) 
+            # The product is read from the cache (or read through from the DB) already encoded, and spliced into the response
+            product = await app.ctx.product_cache.get(product_id)
+            if product is None: 
+                return  json({"message": "Product not found"}, status=201)    
+            else:                                   
+                return  raw(b'{"message":"Product found","data":' + product + b'}', status=201, content_type='application/json') 
         else:
              return  json({"message": "ID length must be between 32..36 characters"}, status=201) 
                 
@@ -142,46 +249,67 @@ async def get_product(request, product_id):
         #print(e)      
         return  json({"message": "Product not found"}, status=201)
 
-# Service API to get the single product information
-@app.get("/products/list", ignore_body=False)
+# Service API to get the hit/miss/eviction counters of this worker's product cache
+@app.get("/products/cache/stats")
+async def get_product_cache_stats(request):
+    return  json({"message": "Product cache stats","data": app.ctx.product_cache.stats()}, status=201)
+
+# Service API to get the list of products, page by page in creation order: /products/list?limit=20&cursor=<next_cursor>
+@app.get("/products/list")
 async def get_product_list(request):
-    # Fetch product by product_id    
     try:        
-        list_params = request.json   
-        limit = 5   
-        offset = 0   
-
-        if list_params and list_params.get('limit'):  
-            limit = list_params.get('limit')
-        
-        if list_params and list_params.get('offset'):  
-            offset = list_params.get('offset')      
-
-        async with app.ctx.db.acquire() as connection:    
-            query = "SELECT * FROM product_service_db.products limit $1 offset $2"            
-            products = await connection.fetch(query, limit, offset)                                   
-            if not products: 
-                return  json({"message": "No products"}, status=201)    
-            else:  
-                product_list = []
-                for record in products:                    
-                    json_record = {
-                        "id": str(record['id']),
-                        "name": record['name'],
-                        "description": record['description'],
-                        "price": float(record['price']),
-                        "created_at": record['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
-                        "updated_at": record['updated_at'].strftime('%Y-%m-%d %H:%M:%S'),
-                    }
-                    product_list.append(json_record)                                                           
-                return  json({"message": "Product found","data": product_list}, status=201) 
-        
+        try:
+            limit = int(request.args.get('limit', PRODUCT_LIST_DEFAULT_LIMIT))
+        except ValueError:
+            return  json({"message": "limit must be a number"}, status=201)
+        limit = max(1, min(limit, PRODUCT_LIST_MAX_LIMIT))
+        cursor = request.args.get('cursor')
+
+        try:
+            products, next_cursor = await fetch_page(app.ctx.db, limit, cursor)
+        except ValueError:
+            return  json({"message": "Invalid cursor"}, status=201)
+        if not products: 
+            return  json({"message": "No products"}, status=201)    
+        else:  
+            product_list = []
+            for record in products:                    
+                json_record = {
+                    "id": str(record['id']),
+                    "name": record['name'],
+                    "description": record['description'],
+                    "price": float(record['price']),
+                    "created_at": record['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                    "updated_at": record['updated_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                }
+                product_list.append(json_record)                                                           
+            return  json({"message": "Product found","data": product_list,"next_cursor": next_cursor}, status=201) 
                 
     except Exception as e:     
         print(e)      
         return  json({"message": "No products"}, status=201)
 
 
+# Service API to export every product as newline-delimited JSON, streamed: /products/export?updated_since=<updated_at>
+# For incremental syncs pass the updated_at of the last product received, products updated since then are sent (again).
+@app.get("/products/export")
+async def export_products(request):
+    try:
+        updated_since = parse_watermark(request.args.get('updated_since'))
+    except ValueError:
+        return  json({"message": "updated_since must be an ISO timestamp"}, status=201)
+    response = await request.respond(content_type="application/x-ndjson")
+    try:
+        await stream_products(app.ctx.db, response, updated_since, PRODUCT_EXPORT_CHUNK_ROWS)
+    except Exception as e:
+        # The status is already sent. Drop the connection without the end of the chunked body, so the client sees
+        # a truncated stream (not a complete but short one) and resumes from its last updated_at.
+        print(e)
+        request.transport.close()
+        return
+    await response.eof()
+
+
 if __name__ == "__main__":
     app.run( host=API_HOST, port=API_PORT, debug=True )
 
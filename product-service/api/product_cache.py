@@ -0,0 +1,156 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+# Asyncio adapter around the confluent_kafka Consumer
+from kafka_consumer import AsyncConsumer
+from event_codec import DecodeError, ProductChanged, decode
+
+# The "data" object of a product response, encoded by Postgres. The cache keeps these bytes as they are.
+PRODUCT_JSON = """
+    SELECT json_build_object('id', id, 'name', name, 'description', description, 'price', price)::text
+    FROM product_service_db.products WHERE id = $1
+"""
+PRODUCTS_JSON = """
+    SELECT id, json_build_object('id', id, 'name', name, 'description', description, 'price', price)::text AS product
+    FROM product_service_db.products WHERE id = ANY($1::uuid[])
+"""
+
+
+# Per process read-through cache of the encoded products, keyed by product id. Entries are dropped after ttl
+# seconds, the least recently used ones beyond maxsize, and the changed ones as soon as the service writes them or
+# their event arrives on the product topic, so every worker and replica converges.
+class ProductCache:
+    def __init__(self, pool, maxsize=10000, ttl=60.0):
+        self._pool = pool
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._products = OrderedDict()  # product id -> (expires at, encoded product)
+        # Bumped by every invalidation, a product read before one is not cached (it may predate the change)
+        self._generation = 0
+        self._consumer = None
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # Encoded product from the cache only, None when it is not cached
+    def get_cached(self, product_id):
+        entry = self._products.get(product_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] < time.monotonic():
+            del self._products[product_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._products.move_to_end(product_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, product_id, body, generation):
+        if generation != self._generation or self.maxsize <= 0:
+            return
+        self._products[product_id] = (time.monotonic() + self.ttl, body)
+        self._products.move_to_end(product_id)
+        while len(self._products) > self.maxsize:
+            self._products.popitem(last=False)
+            self.evictions += 1
+
+    # Encoded product (bytes), from the cache or read through from the DB. None when the product does not exist.
+    async def get(self, product_id):
+        product_id = str(uuid.UUID(product_id))
+        body = self.get_cached(product_id)
+        if body is not None:
+            return body
+        generation = self._generation
+        text = await self._pool.fetchval(PRODUCT_JSON, product_id)
+        if text is None:
+            return None
+        body = text.encode('utf-8')
+        self.put(product_id, body, generation)
+        return body
+
+    # Encoded products of canonical product ids as {product id: bytes}, the ones which are not cached are read through
+    # with a single query. Products which do not exist are left out.
+    async def get_many(self, product_ids):
+        found = {}
+        missing = []
+        for product_id in dict.fromkeys(product_ids):
+            body = self.get_cached(product_id)
+            if body is None:
+                missing.append(product_id)
+            else:
+                found[product_id] = body
+        if missing:
+            generation = self._generation
+            for record in await self._pool.fetch(PRODUCTS_JSON, missing):
+                product_id = str(record['id'])
+                found[product_id] = record['product'].encode('utf-8')
+                self.put(product_id, found[product_id], generation)
+        return found
+
+    def invalidate(self, product_id):
+        self._generation += 1
+        self.invalidations += 1
+        self._products.pop(str(product_id), None)
+
+    def clear(self):
+        self._generation += 1
+        self._products.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._products),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    # Follow the product topic, every process reads it whole from now on: its own throwaway group, nothing committed
+    def start(self, consumer_config, topic):
+        self._consumer = AsyncConsumer(dict(consumer_config, **{
+            'group.id': f"product-service-cache-{uuid.uuid4()}",
+            'auto.offset.reset': 'latest',
+            'enable.auto.commit': False,
+        }), [topic])
+        self._consumer.start()
+        self._task = asyncio.get_running_loop().create_task(self._follow())
+
+    async def _follow(self):
+        while True:
+            for msg in await self._consumer.getmany():
+                if msg.error():
+                    # Events may have been missed
+                    print(f"Product cache consumer error, clearing the cache: {msg.error()}")
+                    self.clear()
+                    continue
+                try:
+                    self.invalidate(decode(ProductChanged, msg.value()).product_id)
+                except Exception as e:
+                    # Unknown payload (or one which cannot be read for now), drop everything rather than serve a
+                    # stale product, and keep following
+                    if not isinstance(e, DecodeError):
+                        print(f"Product cache invalidation failed, clearing the cache: {e}")
+                    self.clear()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._consumer is not None:
+            await self._consumer.close()
+            self._consumer = None
@@ -0,0 +1,179 @@
+import collections
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+# Rows are COPYed into this temp table (dropped at commit), then merged into products with one statement
+STAGING_TABLE = 'products_import'
+CREATE_STAGING = f"""
+    CREATE TEMP TABLE {STAGING_TABLE} (row_no INTEGER, name VARCHAR(255), description TEXT, price DECIMAL)
+    ON COMMIT DROP
+"""
+STAGING_COLUMNS = ['row_no', 'name', 'description', 'price']
+# When a name appears more than once the last row wins. Products whose description and price did not change are
+# left alone (no update, no event). inserted tells a new product from an updated one.
+MERGE_STAGING = f"""
+    INSERT INTO product_service_db.products(name, description, price)
+    SELECT DISTINCT ON (name) name, description, price FROM {STAGING_TABLE}
+    ORDER BY name, row_no DESC
+    ON CONFLICT (name) DO UPDATE SET description = EXCLUDED.description, price = EXCLUDED.price
+    WHERE products.description IS DISTINCT FROM EXCLUDED.description OR products.price IS DISTINCT FROM EXCLUDED.price
+    RETURNING id, name, price, (xmax = 0) AS inserted
+"""
+CSV_CONTENT_TYPES = ('text/csv',)
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+# (name, description, price) of a product row, raises ValueError with the reason when it is not valid
+def validate_row(item):
+    if not isinstance(item, dict):
+        raise ValueError("Row must be an object with name, description and price")
+    name = item.get('name')
+    if not name or not isinstance(name, str):
+        raise ValueError("Product name should not be empty")
+    if len(name) > 255:
+        raise ValueError("Product name is longer than 255 characters")
+    price = item.get('price')
+    if price is None or price == '':
+        raise ValueError("Product price should not be empty")
+    try:
+        price = Decimal(str(price))
+    except InvalidOperation:
+        raise ValueError(f"Invalid price {item.get('price')!r}")
+    if not price.is_finite() or price < 0:
+        raise ValueError(f"Invalid price {item.get('price')!r}")
+    description = item.get('description')
+    return name, None if description is None else str(description), price
+
+
+# Lines of a streamed request body, without reading it whole. Only the new chunk is split, the pieces of a line
+# spanning chunks are joined once it ends, so every byte is scanned once.
+async def iter_lines(stream):
+    pending = []  # pieces of the current line, from the previous chunks
+    while True:
+        chunk = await stream.read()
+        if chunk is None:
+            break
+        *lines, rest = chunk.split(b'\n')
+        if lines:
+            if pending:
+                lines[0] = b''.join(pending) + lines[0]
+                pending = []
+            for line in lines:
+                yield line
+        if rest:
+            pending.append(rest)
+    if pending:
+        yield b''.join(pending)
+
+
+# Whole streamed request body, its chunks joined once
+async def read_body(stream):
+    chunks = []
+    while True:
+        chunk = await stream.read()
+        if chunk is None:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+# Lines given to the csv.reader of a CSV body as they arrive, the reader pulls them one at a time
+class CsvLines:
+    def __init__(self):
+        self._lines = collections.deque()
+
+    def feed(self, line):
+        self._lines.append(line.rstrip('\r') + '\n')
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._lines:
+            raise StopIteration
+        return self._lines.popleft()
+
+
+# (row number, item or None, error or None) of every row of the body: a JSON array, or streamed NDJSON or CSV
+# (with a name,description,price header line, quoted fields may hold line breaks)
+async def iter_rows(content_type, stream):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        row_no = 0
+        async for line in iter_lines(stream):
+            if not line.strip():
+                continue
+            row_no += 1
+            try:
+                yield row_no, json.loads(line), None
+            except ValueError as e:
+                yield row_no, None, f"Invalid JSON: {e}"
+    elif content_type in CSV_CONTENT_TYPES:
+        # One csv.reader over the whole body, fed a line at a time, so a quoted field may span lines. It is only
+        # asked for a record once the fed lines close every quote (an even number of '"', "" escapes included).
+        lines = CsvLines()
+        reader = csv.reader(lines)
+        header = None
+        row_no = 0
+        in_quotes = False
+        encoding = 'utf-8-sig'  # a byte order mark is only skipped at the start
+        async for line in iter_lines(stream):
+            lines.feed(line.decode(encoding, errors='replace'))
+            encoding = 'utf-8'
+            in_quotes ^= line.count(b'"') % 2 == 1
+            if in_quotes:
+                continue
+            values = next(reader)
+            if not any(value.strip() for value in values):
+                continue
+            if header is None:
+                header = [column.strip().lower() for column in values]
+                continue
+            row_no += 1
+            if len(values) != len(header):
+                yield row_no, None, f"Expected {len(header)} columns, got {len(values)}"
+            else:
+                yield row_no, dict(zip(header, values)), None
+        if in_quotes:
+            yield row_no + 1, None, "Unterminated quoted field at the end of the body"
+    else:
+        try:
+            items = json.loads(await read_body(stream))
+        except ValueError as e:
+            yield 0, None, f"Invalid JSON: {e}"
+            return
+        if not isinstance(items, list):
+            yield 0, None, "Body must be a JSON array of products"
+            return
+        for row_no, item in enumerate(items, 1):
+            yield row_no, item, None
+
+
+# Read and validate every row of the body before the DB is touched, so a slow client holds neither a pool connection
+# nor a transaction while it uploads. The body size is bounded by Sanic's REQUEST_MAX_SIZE.
+# Returns (received, valid rows as (row number, name, description, price), [{'row', 'error'}]).
+async def read_rows(content_type, stream):
+    received = 0
+    rows = []
+    errors = []
+    async for row_no, item, error in iter_rows(content_type, stream):
+        received += 1
+        if error is None:
+            try:
+                rows.append((row_no,) + validate_row(item))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            errors.append({'row': row_no, 'error': error})
+    return received, rows, errors
+
+
+# Load the rows of read_rows into products, batch_size rows per COPY into the staging table, then one merge, all in
+# one transaction. Returns the changed products as (id, name, price, inserted) records.
+async def import_products(connection, rows, batch_size=5000):
+    async with connection.transaction():
+        await connection.execute(CREATE_STAGING)
+        for start in range(0, len(rows), batch_size):
+            await connection.copy_records_to_table(STAGING_TABLE, records=rows[start:start + batch_size], columns=STAGING_COLUMNS)
+        return await connection.fetch(MERGE_STAGING)
@@ -0,0 +1,48 @@
+# Run this command from the product-service/api directory: python -m unittest test_product_import
+import asyncio
+import unittest
+from product_import import iter_rows
+
+
+# Request stream handing out the body in chunks of the given size, like request.stream of a streamed Sanic route
+class ChunkedStream:
+    def __init__(self, body, chunk_size):
+        self._chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    async def read(self):
+        return self._chunks.pop(0) if self._chunks else None
+
+
+def read_rows(content_type, body, chunk_size=7):
+    async def collect():
+        return [row async for row in iter_rows(content_type, ChunkedStream(body, chunk_size))]
+    return asyncio.run(collect())
+
+
+class CsvImportTest(unittest.TestCase):
+    def test_quoted_description_with_line_breaks(self):
+        body = (
+            b'name,description,price\r\n'
+            b'Lamp,"Warm light\r\nfor the ""reading"" corner",19.90\r\n'
+            b'Chair,Oak,45\r\n'
+        )
+        self.assertEqual(read_rows('text/csv', body), [
+            (1, {'name': 'Lamp', 'description': 'Warm light\nfor the "reading" corner', 'price': '19.90'}, None),
+            (2, {'name': 'Chair', 'description': 'Oak', 'price': '45'}, None),
+        ])
+
+    def test_row_numbers_after_a_bad_row(self):
+        body = b'\xef\xbb\xbfname,description,price\nA,"x\ny",1\nB,2\n\nC,z,3\n'
+        self.assertEqual(read_rows('text/csv; charset=utf-8', body), [
+            (1, {'name': 'A', 'description': 'x\ny', 'price': '1'}, None),
+            (2, None, "Expected 3 columns, got 2"),
+            (3, {'name': 'C', 'description': 'z', 'price': '3'}, None),
+        ])
+
+    def test_unterminated_quote(self):
+        rows = read_rows('text/csv', b'name,description,price\nA,"open,1\n')
+        self.assertEqual(rows, [(1, None, "Unterminated quoted field at the end of the body")])
+
+
+if __name__ == '__main__':
+    unittest.main()
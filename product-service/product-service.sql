@@ -22,6 +22,11 @@ CREATE TABLE IF NOT EXISTS products (
     updated_at TIMESTAMP DEFAULT current_timestamp
 );
 
+-- Keyset pagination of the product list (GET /products/list) walks this index in (created_at, id) order
+CREATE INDEX IF NOT EXISTS products_created_at_id_idx ON products(created_at, id);
+-- The catalog export (GET /products/export) reads the products in (updated_at, id) order from a watermark
+CREATE INDEX IF NOT EXISTS products_updated_at_id_idx ON products(updated_at, id);
+
 -- Create a trigger function to update the 'updated_at' timestamp on every update
 CREATE OR REPLACE FUNCTION update_updated_at()
 RETURNS TRIGGER AS $$
@@ -0,0 +1,79 @@
+import asyncio
+# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
+from confluent_kafka import KafkaException, Producer
+
+# How long the poll task sleeps when there were no delivery reports to serve (seconds)
+POLL_INTERVAL = 0.05
+# How long send() backs off when the local librdkafka queue is full (seconds)
+QUEUE_FULL_BACKOFF = 0.01
+
+
+# Asyncio wrapper around the confluent_kafka Producer.
+# produce() only appends the message to librdkafka's local queue, the broker round trip happens in librdkafka's own threads.
+# A background task serves the delivery reports with poll(0), so nothing on the request path ever blocks the event loop.
+class AsyncProducer:
+    def __init__(self, config, poll_interval=POLL_INTERVAL):
+        self._producer = Producer(config)
+        self._poll_interval = poll_interval
+        self._poll_task = None
+        self._running = False
+
+    # Start the background poll task on the running loop. Call it from a before_server_start listener.
+    def start(self):
+        if self._poll_task is None:
+            self._running = True
+            self._poll_task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def _poll_loop(self):
+        while self._running:
+            # poll(0) never waits, it only runs the delivery callbacks which are already queued
+            served = self._producer.poll(0)
+            await asyncio.sleep(0 if served else self._poll_interval)
+
+    # Queue a message and return a future resolved with the delivered message (or failed with KafkaException).
+    # Callers on the request path should not await the returned future.
+    async def send(self, topic, value, key=None, headers=None, callback=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Failures are already reported through the callback, don't log them again when nobody awaits the future
+        future.add_done_callback(_mark_retrieved)
+
+        def on_delivery(err, msg):
+            if callback:
+                callback(err, msg)
+            # Delivery reports are served by the poll task, but flush() in close() serves them from an executor thread
+            loop.call_soon_threadsafe(_resolve_delivery, future, err, msg)
+
+        while True:
+            try:
+                self._producer.produce(topic, value=value, key=key, headers=headers, on_delivery=on_delivery)
+                return future
+            except BufferError:
+                # Local queue is full, let the poll task drain some delivery reports first
+                await asyncio.sleep(QUEUE_FULL_BACKOFF)
+
+    # Fire and forget produce for code which cannot await, e.g. delivery callbacks routing to the DLQ
+    def produce(self, topic, value, key=None, headers=None):
+        self._producer.produce(topic, value=value, key=key, headers=headers)
+
+    # Stop the poll task and wait for the outstanding messages without blocking the loop
+    async def close(self, timeout=10):
+        self._running = False
+        if self._poll_task is not None:
+            await self._poll_task
+            self._poll_task = None
+        await asyncio.get_running_loop().run_in_executor(None, self._producer.flush, timeout)
+
+
+def _mark_retrieved(future):
+    if not future.cancelled():
+        future.exception()
+
+
+def _resolve_delivery(future, err, msg):
+    if future.done():
+        return
+    if err:
+        future.set_exception(KafkaException(err))
+    else:
+        future.set_result(msg)
@@ -4,8 +4,12 @@ from sanic.response import json
 from decouple import config 
 # This library we are using to connect API with database postgresql. Install this dependency by running this command : pip install asyncpg
 import asyncpg
-# This library we are using to connect kafka. Install this dependency by running this command : pip install confluent_kafka
-from confluent_kafka import Producer
+# Asyncio wrapper around the confluent_kafka Producer. Install this dependency by running this command : pip install confluent_kafka
+from kafka_producer import AsyncProducer
+# Typed encoding and decoding of the Kafka events. Install this dependency by running this command : pip install msgspec
+from event_codec import DeadLetter, UserRegistered, configure as configure_codec, encode
+# Client for the Confluent schema registry used by the avro wire format
+from schema_registry import open_registry
 # Import the authenticate and authenticate_middleware functions
 from authentication import authenticate, authenticate_middleware
 
@@ -19,6 +23,9 @@ DB_NAME = config('DB_NAME')
 KAFKA_BOOTSTRAP_SERVERS = config('KAFKA_BOOTSTRAP_SERVERS')
 KAFKA_PRODUCER_TOPIC = config('KAFKA_PRODUCER_TOPIC')
 KAFKA_PRODUCER_TOPIC_DLQ = config('KAFKA_PRODUCER_TOPIC_DLQ')
+# Event Configuration, EVENT_WIRE_FORMAT is 'json' or 'avro' (schema registry framing)
+EVENT_WIRE_FORMAT = config('EVENT_WIRE_FORMAT', default='json')
+SCHEMA_REGISTRY_URL = config('SCHEMA_REGISTRY_URL', default='')
 
 # API Configuration
 API_HOST = config('API_HOST')
@@ -43,21 +50,25 @@ p_conf = {
     'retry.backoff.ms': 60000,  # Wait for 60,000ms (1 minute) before retrying
     'enable.idempotence': True
 }
-p = Producer(p_conf)
+p = AsyncProducer(p_conf)
 
 # Register the middleware
 @app.middleware('request')(authenticate_middleware)
 
 
 
-# Register the setup_db function to be executed before starting the server
+# Register the event codec, the setup_db function and the producer poll task to be executed before starting the server
 @app.listener('before_server_start')
 async def before_server_start(app, loop):
+    # Schemas are registered here once, producing an event never calls the schema registry
+    configure_codec(EVENT_WIRE_FORMAT, open_registry(SCHEMA_REGISTRY_URL))
     await setup_db(app)
+    p.start()
 
-# Register the close_db function to be executed after stopping the server
+# Register the close_db function to be executed after stopping the server, outstanding messages are flushed first
 @app.listener('after_server_stop')
 async def after_server_stop(app, loop):
+    await p.close()
     await close_db(app)
 
 ############## All the functions code starts from here ###########
@@ -84,12 +95,8 @@ async def checkEmail(email):
 def delivery_callback(err, msg):
     try:
         if err:
-            data = msg.value().decode('utf-8')
-            data = data.replace("'", "\"")
-            data = json.loads(data) 
-            data['topic'] = msg.topic()
-            data['error'] = str(err)            
-            p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=str(data) )
+            dead_letter = DeadLetter(topic=msg.topic(), error=str(err), payload=msg.value())
+            p.produce( KAFKA_PRODUCER_TOPIC_DLQ, value=encode(dead_letter), key=msg.key() )
             print(f"Failed to deliver message: {err}. Message might be retried.")
         else:                
             print(f"Message delivered to {msg.topic()} [{msg.partition()}]")
@@ -120,11 +127,9 @@ async def register(request):
                             user_data["username"], user_data["email"], user_data["password"]
                         ) 
 
-                    # Sending message to topic
-                    user_data_for_producer = {"user_id": str(new_user_id), "username": user_data["username"], "email": user_data["email"]}
-                    p.produce( KAFKA_PRODUCER_TOPIC , value=str(user_data_for_producer), callback=delivery_callback )
-                    p.flush()
-                    p.poll(0.5)
+                    # Sending message to topic, keyed by user id so all events of a user land on the same partition
+                    user_event = UserRegistered(user_id=str(new_user_id), username=user_data["username"], email=user_data["email"])
+                    await p.send( KAFKA_PRODUCER_TOPIC , value=encode(user_event), key=user_event.user_id, callback=delivery_callback )
 
                 return json({"message": "User registered successfully","id": str(new_user_id)}, status=201)
     except Exception as e:       